@@ -0,0 +1,44 @@
+"""
+Stand-in for a full screen routine like ``src/clock.mac``: writes redraw
+frames to stdout, paced at --fps or as fast as possible with --fps 0. With
+--input it replays a captured terminal stream instead.
+
+    python benchmarks/ansi_replay.py --fps 0 --frames 2000
+"""
+import argparse
+import sys
+import time
+
+from screen_savings import clock_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=" ".join(__doc__.strip().split("\n\n")[0].split())
+    )
+    parser.add_argument("--input", help="captured terminal output to replay")
+    parser.add_argument("--fps", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--lines", type=int, default=24)
+    args = parser.parse_args()
+
+    out = sys.stdout.buffer
+    if args.input:
+        with open(args.input, "rb") as f:
+            out.write(f.read())
+        out.flush()
+        return
+
+    fps = args.fps or 50
+    start = time.monotonic()
+    frames = clock_frames(fps, args.frames / fps, args.columns, args.lines)
+    for now, data in frames:
+        if args.fps:
+            time.sleep(max(0, start + now - time.monotonic()))
+        out.write(data)
+        out.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Throughput of the CLI output path on a bulk output, like a large zwrite.
+
+``print`` is the old path (1 KB reads, decode, ``print()`` per chunk),
+``buffer`` the current one (adaptive reads into the preallocated buffer of
+``IRISSession``, written as bytes to ``sys.stdout.buffer`` and flushed once
+per burst), ``dd`` the same pty read by ``dd`` as the ceiling. Output goes
+to /dev/null, ``yes | head -c BYTES`` stands in for IRIS.
+
+The pty line discipline usually limits the wall time of all three, the
+difference is in the cpu time of the reading process.
+
+    python benchmarks/cli_output.py --bytes 268435456
+"""
+import argparse
+import io
+import json
+import os
+import select
+import subprocess
+import sys
+import time
+
+# runs from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iterm.irissession import IRISSession  # noqa: E402
+from iterm.relay import text_decoder  # noqa: E402
+
+
+def print_path(session, devnull):
+    stdout = io.TextIOWrapper(io.FileIO(devnull, "w", closefd=False))
+    decoder = text_decoder()
+    while True:
+        (data_ready, _, _) = select.select([session.fd], [], [], 1)
+        if not data_ready:
+            break
+        try:
+            data = os.read(session.fd, 1024)
+        except OSError:
+            break
+        if not data:
+            break
+        print(decoder.decode(data), file=stdout)
+    stdout.flush()
+
+
+def buffer_path(session, devnull):
+    stdout = io.BufferedWriter(io.FileIO(devnull, "w", closefd=False))
+    while True:
+        try:
+            output = session.read_bytes(1)
+        except OSError:
+            break
+        if not output:
+            break
+        stdout.write(output)
+        if session.reader.drained:
+            stdout.flush()
+    stdout.flush()
+
+
+def dd_path(session, devnull):
+    subprocess.run(
+        ["dd", "bs=256K", "iflag=fullblock"],
+        stdin=session.fd,
+        stdout=devnull,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+PATHS = {"print": print_path, "buffer": buffer_path, "dd": dd_path}
+
+
+def run(path, size):
+    session = IRISSession.start("yes | head -c %d" % size)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    if path == "dd":
+        # dd gets a blocking fd, the way a shell would hand it over
+        os.set_blocking(session.fd, True)
+    cpu = time.process_time()
+    start = time.perf_counter()
+    PATHS[path](session, devnull)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    os.close(devnull)
+    session.close()
+    return {
+        "path": path,
+        "bytes": size,
+        "seconds": round(elapsed, 4),
+        "mb_per_s": round(size / elapsed / 1024 / 1024, 1),
+        # of this process, dd runs in a child and does not count
+        "cpu_seconds": round(cpu, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=" ".join(__doc__.strip().split("\n\n")[0].split())
+    )
+    parser.add_argument("--bytes", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [run(path, args.bytes) for path in PATHS]
+    for result in results:
+        print(
+            "{path:>6}: {mb_per_s} MB/s, {seconds} s, cpu {cpu_seconds} s".format(
+                **result
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Compare the ``iTerm.Engine`` relay loops outside of IRIS.
+
+``hang`` is the old ``Server()`` loop (zero timeout websocket read, pump the
+pty, ``hang 0.01``), ``poll`` the first ``relay()`` method, which waited on
+the pty while output was expected and on the websocket for up to 0.25
+seconds otherwise, and ``relay`` the current one, which leaves the pty to a
+``PtyWatcher`` thread and blocks on the websocket and the wake up connection
+of the watcher together. The websocket is stood in for by a socketpair and
+the session by a local ``cat`` in a pty, so the numbers show the shape of
+the loops, not IRIS itself.
+
+Besides typing echo, the latency of output the user did not trigger, like
+job messages or broadcasts, is measured on a session printing the time
+every 1.1 to 1.5 seconds, to a loop that has gone idle in between. Both
+include the coalescing delay of the output, 8 ms by default.
+
+    python benchmarks/engine_loop.py --sessions 50 --seconds 5
+"""
+import argparse
+import json
+import os
+import select
+import socket
+import statistics
+import sys
+import threading
+import time
+
+# runs from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idle_relay import spawn  # noqa: E402
+from iterm.relay import InputQueue, OutputCoalescer, PtyReader, PtyWatcher  # noqa: E402
+
+IDLE_WAIT = 0.25
+ACTIVE_WAIT = 0.01
+ACTIVE_WINDOW = 1
+# the relay wakes this often to publish its counters, MetricsInterval
+METRICS_INTERVAL = 1
+
+TICKER = """
+import random, sys, time
+while True:
+    time.sleep(random.uniform(1.1, 1.5))
+    sys.stdout.write("%r\\n" % time.monotonic())
+    sys.stdout.flush()
+"""
+
+
+def _pidfd(pid):
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+class Loop(object):
+    """What the loops need of ``iTerm.Engine``: websocket, pty and pump."""
+
+    def __init__(self, sock, fd, proc):
+        self.sock = sock
+        self.fd = fd
+        self.proc = proc
+        # the session pty is non-blocking
+        os.set_blocking(fd, False)
+        self.input = InputQueue(fd)
+        self.coalescer = OutputCoalescer()
+        self.reader = PtyReader(fd)
+        self.exit_fd = _pidfd(proc.pid)
+
+    def exited(self):
+        if self.exit_fd is not None:
+            (ready, _, _) = select.select([self.exit_fd], [], [], 0)
+            if not ready:
+                return False
+        return self.proc.poll() is not None
+
+    def read(self, timeout):
+        """``%CSP.WebSocket.Read()``, None on timeout, "" once closed."""
+        (ready, _, _) = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return None
+        return self.sock.recv(4096)
+
+    def receive(self, data):
+        self.coalescer.mark_input()
+        os.write(self.fd, data)
+
+    def pump(self):
+        coalescer = self.coalescer
+        while True:
+            (ready, _, _) = select.select([self.fd], [], [], 0)
+            try:
+                output = self.reader.read() if ready else b""
+            except OSError:
+                # child is gone
+                return False
+            if not output or coalescer.feed(output):
+                break
+        if not coalescer.due():
+            return False
+        self.send(coalescer.flush())
+        return True
+
+    def send(self, output):
+        self.sock.sendall(output)
+
+
+def hang_loop(loop, stop):
+    while not stop.is_set():
+        data = loop.read(0)
+        if data == b"":
+            break
+        if data:
+            loop.receive(data)
+        if loop.proc.poll() is not None:
+            break
+        loop.pump()
+        time.sleep(0.01)
+
+
+def poll_loop(loop, stop):
+    last_activity = time.monotonic()
+    while not stop.is_set():
+        exited = False
+        if len(loop.coalescer) or time.monotonic() - last_activity < ACTIVE_WINDOW:
+            wait = loop.coalescer.timeout()
+            rlist = [loop.fd] if loop.exit_fd is None else [loop.fd, loop.exit_fd]
+            (ready, _, _) = select.select(
+                rlist, [], [], ACTIVE_WAIT if wait is None else min(wait, ACTIVE_WAIT)
+            )
+            exited = loop.exit_fd in ready
+            timeout = 0
+        else:
+            timeout = IDLE_WAIT
+        data = loop.read(timeout)
+        if data == b"":
+            break
+        if data:
+            loop.receive(data)
+            last_activity = time.monotonic()
+        if exited or (timeout and loop.exited()):
+            break
+        if loop.pump():
+            last_activity = time.monotonic()
+
+
+def relay_loop(loop, stop):
+    watcher = PtyWatcher()
+    wake = socket.create_connection(("127.0.0.1", watcher.port))
+    watcher.watch(loop)
+    coalescer = loop.coalescer
+    try:
+        while not stop.is_set():
+            due = coalescer.timeout()
+            timeout = METRICS_INTERVAL if due is None else min(due, METRICS_INTERVAL)
+            # $System.Socket.Select on the websocket and the wake up connection
+            (ready, _, _) = select.select([loop.sock, wake], [], [], timeout)
+            if loop.sock in ready:
+                data = loop.sock.recv(4096)
+                if not data:
+                    break
+                coalescer.mark_input()
+                watcher.put(data)
+            if wake in ready:
+                wake.recv(4096)
+            output = watcher.take()
+            if output:
+                coalescer.feed(output)
+            if watcher.ended:
+                if len(coalescer):
+                    loop.send(coalescer.flush())
+                break
+            if coalescer.due():
+                loop.send(coalescer.flush())
+    finally:
+        watcher.close()
+        wake.close()
+
+
+LOOPS = {"hang": hang_loop, "poll": poll_loop, "relay": relay_loop}
+
+
+def unsolicited(target, ticks):
+    """Latencies of output the user did not trigger, a session printing the
+    time while the loop is idle."""
+    proc, fd = spawn([sys.executable, "-c", TICKER])
+    client, server = socket.socketpair()
+    loop = Loop(server, fd, proc)
+    stop = threading.Event()
+    thread = threading.Thread(target=target, args=(loop, stop))
+    thread.daemon = True
+    thread.start()
+
+    latencies = []
+    pending = b""
+    while len(latencies) < ticks:
+        (ready, _, _) = select.select([client], [], [], 3)
+        if not ready:
+            break
+        pending += client.recv(4096)
+        now = time.monotonic()
+        *lines, pending = pending.split(b"\n")
+        latencies.extend(now - float(line) for line in lines if line.strip())
+
+    stop.set()
+    proc.kill()
+    proc.wait()
+    thread.join()
+    os.close(fd)
+    server.close()
+    client.close()
+    if loop.exit_fd is not None:
+        os.close(loop.exit_fd)
+    return sorted(latencies)
+
+
+def _percentiles(latencies, name):
+    return {
+        name + "_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        name + "_p99_ms": round(
+            latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 3
+        ),
+    }
+
+
+def run(name, sessions, seconds, echoes, ticks):
+    target = LOOPS[name]
+    stop = threading.Event()
+    clients = []
+    procs = []
+    threads = []
+    loops = []
+
+    for _ in range(sessions):
+        proc, fd = spawn(["cat"])
+        client, server = socket.socketpair()
+        procs.append((proc, fd, server))
+        clients.append(client)
+        loops.append(Loop(server, fd, proc))
+        thread = threading.Thread(target=target, args=(loops[-1], stop))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # let the loops go idle before measuring the idle cost
+    time.sleep(ACTIVE_WINDOW + 0.2)
+    cpu = time.process_time()
+    time.sleep(seconds)
+    idle_cpu = (time.process_time() - cpu) / seconds / sessions
+
+    client = clients[0]
+    latencies = []
+    for _ in range(echoes):
+        start = time.perf_counter()
+        client.sendall(b"x")
+        select.select([client], [], [], 1)
+        client.recv(4096)
+        latencies.append(time.perf_counter() - start)
+        # half of the keystrokes come after a pause, from an idle loop
+        time.sleep(ACTIVE_WINDOW + 0.05 if len(latencies) % 2 else 0.005)
+    latencies.sort()
+
+    stop.set()
+    for proc, _, _ in procs:
+        proc.kill()
+        proc.wait()
+    for thread in threads:
+        thread.join()
+    for (_, fd, server), client in zip(procs, clients):
+        os.close(fd)
+        server.close()
+        client.close()
+    for loop in loops:
+        if loop.exit_fd is not None:
+            os.close(loop.exit_fd)
+
+    result = {
+        "loop": name,
+        "sessions": sessions,
+        "idle_cpu_per_session_pct": round(idle_cpu * 100, 4),
+    }
+    result.update(_percentiles(latencies, "echo_latency"))
+    result.update(_percentiles(unsolicited(target, ticks), "unsolicited_latency"))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--echoes", type=int, default=20)
+    parser.add_argument(
+        "--ticks", type=int, default=10, help="output lines the user did not trigger"
+    )
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [
+        run(name, args.sessions, args.seconds, args.echoes, args.ticks)
+        for name in LOOPS
+    ]
+    for result in results:
+        print(
+            "{loop:>6}: {idle_cpu_per_session_pct}% cpu/idle session, "
+            "echo p50 {echo_latency_p50_ms} ms, p99 {echo_latency_p99_ms} ms, "
+            "unsolicited p50 {unsolicited_latency_p50_ms} ms, "
+            "p99 {unsolicited_latency_p99_ms} ms".format(**result)
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
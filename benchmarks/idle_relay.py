@@ -0,0 +1,142 @@
+"""
+Compare the pty relay wait strategies used by the web terminal.
+
+``poll`` is the old ``xterm/views.py`` loop (sleep 10 ms, then a zero timeout
+select), ``block`` waits on fd readiness the way the eventlet hub does. Each
+strategy relays a local ``cat`` running in a pty, so no IRIS instance is
+needed.
+
+    python benchmarks/idle_relay.py --sessions 50 --seconds 5
+"""
+import argparse
+import json
+import os
+import pty
+import select
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+
+def spawn(cmd):
+    master_fd, slave_fd = pty.openpty()
+    proc = subprocess.Popen(
+        cmd,
+        stdin=slave_fd,
+        stdout=slave_fd,
+        stderr=slave_fd,
+        close_fds=True,
+        start_new_session=True,
+    )
+    os.close(slave_fd)
+    return proc, master_fd
+
+
+def poll_reader(fd, on_output, stop):
+    while not stop.is_set():
+        time.sleep(0.01)
+        (data_ready, _, _) = select.select([fd], [], [], 0)
+        if data_ready:
+            try:
+                output = os.read(fd, 1024 * 20)
+            except OSError:
+                return
+            on_output(output)
+
+
+def block_reader(fd, on_output, stop):
+    while not stop.is_set():
+        (data_ready, _, _) = select.select([fd], [], [])
+        if data_ready:
+            try:
+                output = os.read(fd, 1024 * 20)
+            except OSError:
+                return
+            on_output(output)
+
+
+READERS = {"poll": poll_reader, "block": block_reader}
+
+
+def run(strategy, sessions, seconds, echoes):
+    reader = READERS[strategy]
+    stop = threading.Event()
+    procs = []
+    threads = []
+    arrived = threading.Event()
+
+    def on_output(output):
+        arrived.set()
+
+    for _ in range(sessions):
+        proc, fd = spawn(["cat"])
+        procs.append((proc, fd))
+        thread = threading.Thread(target=reader, args=(fd, on_output, stop))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # let the readers settle before measuring the idle cost
+    time.sleep(0.2)
+    cpu = time.process_time()
+    time.sleep(seconds)
+    idle_cpu = (time.process_time() - cpu) / seconds / sessions
+
+    _, fd = procs[0]
+    latencies = []
+    for _ in range(echoes):
+        arrived.clear()
+        start = time.perf_counter()
+        os.write(fd, b"x")
+        arrived.wait(1)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.005)
+    latencies.sort()
+
+    stop.set()
+    for proc, _ in procs:
+        proc.kill()
+        proc.wait()
+    for thread in threads:
+        thread.join()
+    for _, fd in procs:
+        os.close(fd)
+
+    return {
+        "strategy": strategy,
+        "sessions": sessions,
+        "idle_cpu_per_session_pct": round(idle_cpu * 100, 4),
+        "echo_latency_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "echo_latency_p99_ms": round(
+            latencies[int(len(latencies) * 0.99) - 1] * 1000, 3
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--echoes", type=int, default=200)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = [
+        run(strategy, args.sessions, args.seconds, args.echoes) for strategy in READERS
+    ]
+    for result in results:
+        print(
+            "{strategy:>6}: {idle_cpu_per_session_pct}% cpu/idle session, "
+            "echo p50 {echo_latency_p50_ms} ms, p99 {echo_latency_p99_ms} ms".format(
+                **result
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
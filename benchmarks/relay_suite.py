@@ -0,0 +1,284 @@
+"""
+Throughput and latency of the terminal relay paths against local stand-ins.
+
+Paths:
+
+- ``irissession``: ``IRISSession.read()``, as the CLI reads it;
+- ``views``: a port of ``read_and_forward_pty_output`` from
+  ``iterm/xterm/views.py``, with plain select instead of the eventlet hub;
+- ``engine``: the Python port of the ``iTerm.Engine`` relay loop from
+  ``engine_loop.py``.
+
+Workloads, each run in a pty through ``IRISSession.start(cmd=...)``:
+
+- ``yes``: bulk output, ``yes | head -c BYTES``;
+- ``replay``: full screen redraws like ``src/clock.mac``, from
+  ``ansi_replay.py``;
+- ``cat``: idle sessions and typing echo.
+
+Reports bytes/s, syscalls (select, read, write) per KB of output, CPU per
+session and echo latency p50/p99. Keep the JSON from --output next to a
+change in the hot path and compare.
+
+    python benchmarks/relay_suite.py --output relay.json
+"""
+import argparse
+import json
+import os
+import select
+import socket
+import statistics
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# runs from a checkout, without installing the package
+sys.path.insert(0, os.path.dirname(HERE))
+
+from engine_loop import Loop, relay_loop  # noqa: E402
+from iterm.irissession import IRISSession  # noqa: E402
+from iterm.relay import OutputCoalescer, PtyReader, ScrollbackRing  # noqa: E402
+
+
+class Syscalls(object):
+    """Counts the select, read and write calls made while active."""
+
+    names = [(os, "read"), (os, "readv"), (os, "write"), (select, "select")]
+
+    def __init__(self):
+        self.count = 0
+        self.saved = []
+
+    def __enter__(self):
+        for module, name in self.names:
+            original = getattr(module, name)
+            self.saved.append((module, name, original))
+            setattr(module, name, self._counting(original))
+        return self
+
+    def __exit__(self, *exc):
+        for module, name, original in self.saved:
+            setattr(module, name, original)
+        self.saved = []
+
+    def _counting(self, func):
+        def call(*args, **kwargs):
+            self.count += 1
+            return func(*args, **kwargs)
+
+        return call
+
+
+class IRISSessionPath(object):
+    def __init__(self, session, on_output):
+        self.session = session
+        self.on_output = on_output
+
+    def run(self, stop):
+        session = self.session
+        while not stop.is_set():
+            try:
+                output = session.read(0.1)
+            except OSError:
+                # child is gone
+                break
+            if output is None:
+                continue
+            if not output:
+                break
+            # the CLI prints it, which encodes it again
+            self.on_output(output.encode())
+
+    def type(self, data):
+        self.session.write(data.decode())
+
+
+class ViewsPath(object):
+    def __init__(self, session, on_output):
+        self.session = session
+        self.on_output = on_output
+        self.coalescer = OutputCoalescer()
+        self.scrollback = ScrollbackRing()
+
+    def run(self, stop):
+        fd = self.session.fd
+        reader = PtyReader(fd)
+        coalescer = self.coalescer
+        while not stop.is_set():
+            try:
+                (data_ready, _, _) = select.select([fd], [], [], coalescer.timeout())
+                output = reader.read() if data_ready else b""
+            except OSError:
+                break
+            if data_ready and not output:
+                break
+            if output:
+                coalescer.feed(output)
+            if coalescer.due():
+                self.flush()
+        # the child is gone, send what it left
+        if len(coalescer):
+            self.flush()
+
+    def flush(self):
+        output = self.coalescer.flush()
+        self.scrollback.write(output)
+        self.on_output(output)
+
+    def type(self, data):
+        self.coalescer.mark_input()
+        self.session.input.put(data)
+        self.session.flush_input(0)
+
+
+class EnginePath(object):
+    def __init__(self, session, on_output):
+        self.client, server = socket.socketpair()
+        self.loop = Loop(server, session.fd, session.proc)
+        self.loop.send = on_output
+
+    def run(self, stop):
+        relay_loop(self.loop, stop)
+        self.loop.sock.close()
+        self.client.close()
+
+    def type(self, data):
+        self.client.sendall(data)
+
+
+PATHS = {"irissession": IRISSessionPath, "views": ViewsPath, "engine": EnginePath}
+
+
+def throughput(path, workload, cmd):
+    session = IRISSession.start(cmd)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    received = [0, 0]
+
+    def on_output(output):
+        received[0] += len(output)
+        received[1] += 1
+        # stands in for the websocket send
+        os.write(devnull, output)
+
+    relay = PATHS[path](session, on_output)
+    with Syscalls() as calls:
+        cpu = time.process_time()
+        start = time.perf_counter()
+        relay.run(threading.Event())
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+    session.close()
+    os.close(devnull)
+
+    size, frames = received
+    return {
+        "path": path,
+        "workload": workload,
+        "bytes": size,
+        "frames": frames,
+        "seconds": round(elapsed, 4),
+        "bytes_per_s": round(size / elapsed),
+        "syscalls_per_kb": round(calls.count * 1024 / size, 3) if size else None,
+        "cpu_per_session_pct": round(cpu * 100 / elapsed, 2),
+    }
+
+
+def echo(path, sessions, seconds, echoes):
+    stop = threading.Event()
+    arrived = threading.Event()
+    relays = []
+    threads = []
+    for i in range(sessions):
+        session = IRISSession.start(["cat"])
+        on_output = (lambda output: arrived.set()) if i == 0 else (lambda output: None)
+        relay = PATHS[path](session, on_output)
+        thread = threading.Thread(target=relay.run, args=(stop,))
+        thread.daemon = True
+        thread.start()
+        relays.append((session, relay))
+        threads.append(thread)
+
+    # let the relays go idle before measuring the idle cost
+    time.sleep(1.2)
+    cpu = time.process_time()
+    time.sleep(seconds)
+    idle_cpu = (time.process_time() - cpu) / seconds / sessions
+
+    _, relay = relays[0]
+    latencies = []
+    for _ in range(echoes):
+        arrived.clear()
+        start = time.perf_counter()
+        relay.type(b"x")
+        arrived.wait(1)
+        latencies.append(time.perf_counter() - start)
+        # every other keystroke comes after a pause, from an idle relay
+        time.sleep(1.05 if len(latencies) % 2 else 0.005)
+    latencies.sort()
+
+    stop.set()
+    for session, _ in relays:
+        session.proc.kill()
+        session.proc.wait()
+    for thread in threads:
+        thread.join()
+    for session, _ in relays:
+        session.close()
+
+    return {
+        "path": path,
+        "workload": "cat",
+        "sessions": sessions,
+        "cpu_per_session_pct": round(idle_cpu * 100, 4),
+        "echo_latency_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "echo_latency_p99_ms": round(
+            latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 3
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paths", nargs="+", choices=list(PATHS), default=list(PATHS))
+    parser.add_argument(
+        "--workloads",
+        nargs="+",
+        choices=["yes", "replay", "cat"],
+        default=["yes", "replay", "cat"],
+    )
+    parser.add_argument("--bytes", type=int, default=32 * 1024 * 1024)
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--echoes", type=int, default=20)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    commands = {
+        "yes": "yes | head -c %d" % args.bytes,
+        "replay": [
+            sys.executable,
+            os.path.join(HERE, "ansi_replay.py"),
+            "--fps",
+            "0",
+            "--frames",
+            str(args.frames),
+        ],
+    }
+    results = []
+    for path in args.paths:
+        for workload in args.workloads:
+            if workload == "cat":
+                result = echo(path, args.sessions, args.seconds, args.echoes)
+            else:
+                result = throughput(path, workload, commands[workload])
+            print(json.dumps(result))
+            results.append(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
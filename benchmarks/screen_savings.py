@@ -0,0 +1,90 @@
+"""
+Bytes sent to the client in raw mode versus screen mode.
+
+Replays a terminal stream through iterm.screen.ScreenModel on a simulated
+clock and compares the bytes that reach the client. Without --input it
+generates a full screen redraw loop like the bundled ^clock routine; a
+captured stream (e.g. ``script -q -c 'iris session iris "^clock"'``) can be
+given with --input. Needs the pyte package.
+
+    python benchmarks/screen_savings.py --fps 50 --seconds 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# runs from a checkout, without installing the package, also when
+# ansi_replay.py imports it in a pty of relay_suite.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iterm.screen import ScreenModel  # noqa: E402
+
+
+def clock_frames(fps, seconds, columns, lines):
+    """A redraw loop: clear, a colored box and a ticking time, fps frames a second."""
+    for frame in range(int(fps * seconds)):
+        now = frame / fps
+        out = ["\x1b[H\x1b[2J"]
+        for y in range(lines - 1):
+            color = 31 + (y + frame // fps) % 7
+            out.append("\x1b[%d;1H\x1b[%dm%s\x1b[0m" % (y + 1, color, "#" * (columns // 2)))
+        stamp = time.strftime("%H:%M:%S", time.gmtime(now)) + ".%03d" % (frame % fps)
+        out.append("\x1b[%d;1H%s" % (lines, stamp))
+        yield now, "".join(out).encode()
+
+
+def recorded_frames(path, chunk, rate):
+    """A captured stream, cut into chunks arriving at *rate* bytes a second."""
+    with open(path, "rb") as f:
+        data = f.read()
+    for pos in range(0, len(data), chunk):
+        yield pos / rate, data[pos : pos + chunk]
+
+
+def run(frames, columns, lines, interval):
+    model = ScreenModel(columns, lines, interval=interval)
+    raw = sent = updates = 0
+    now = 0
+    for now, data in frames:
+        raw += len(data)
+        if model.feed(data, now):
+            sent += len(model.flush(now))
+            updates += 1
+    if model.due(now + interval):
+        sent += len(model.flush(now + interval))
+        updates += 1
+    return {
+        "raw_bytes": raw,
+        "screen_bytes": sent,
+        "screen_updates": updates,
+        "savings_pct": round(100 - sent * 100 / raw, 2) if raw else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", help="captured terminal output to replay")
+    parser.add_argument("--fps", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rate", type=int, default=1024 * 1024, help="bytes/s of --input")
+    parser.add_argument("--columns", type=int, default=80)
+    parser.add_argument("--lines", type=int, default=24)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.input:
+        frames = recorded_frames(args.input, 4096, args.rate)
+    else:
+        frames = clock_frames(args.fps, args.seconds, args.columns, args.lines)
+    result = run(frames, args.columns, args.lines, args.interval)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
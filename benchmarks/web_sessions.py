@@ -0,0 +1,100 @@
+"""
+Load test the Django/socket.io web terminal with many concurrent sessions.
+
+Start the server with a cheap stand-in shell, e.g. ``ITERM_COMMAND = ["cat"]``
+in the Django settings, then
+
+    python benchmarks/web_sessions.py http://localhost:8000 --sessions 300
+
+Every client connects, types a few keys and waits for their echo; the script
+reports connect time and echo latency over all sessions. Needs the
+``python-socketio[client]`` package.
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+
+import socketio
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[max(0, int(len(values) * pct) - 1)]
+
+
+class Terminal(object):
+    def __init__(self, url):
+        self.url = url
+        self.client = socketio.Client(reconnection=False)
+        self.client.on("pty_output", self.on_output)
+        self.arrived = threading.Event()
+        self.latencies = []
+
+    def on_output(self, output):
+        self.arrived.set()
+
+    def connect(self):
+        start = time.perf_counter()
+        self.client.connect(self.url, transports=["websocket"])
+        return time.perf_counter() - start
+
+    def type(self, keys):
+        for key in keys:
+            self.arrived.clear()
+            start = time.perf_counter()
+            self.client.emit("pty_input", {"input": key})
+            if self.arrived.wait(5):
+                self.latencies.append(time.perf_counter() - start)
+
+    def close(self):
+        self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=" ".join(__doc__.strip().split("\n\n")[0].split())
+    )
+    parser.add_argument("url")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--keys", default="abcdefghij")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    terminals = [Terminal(args.url) for _ in range(args.sessions)]
+    connect_times = [terminal.connect() for terminal in terminals]
+
+    threads = [
+        threading.Thread(target=terminal.type, args=(args.keys,))
+        for terminal in terminals
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [lat for terminal in terminals for lat in terminal.latencies]
+    for terminal in terminals:
+        terminal.close()
+
+    result = {
+        "sessions": args.sessions,
+        "connect_p50_ms": round(statistics.median(connect_times) * 1000, 3),
+        "echoes": len(latencies),
+        "lost_echoes": args.sessions * len(args.keys) - len(latencies),
+        "echo_latency_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "echo_latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "elapsed_s": round(elapsed, 3),
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
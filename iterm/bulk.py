@@ -0,0 +1,790 @@
+"""
+Bulk export of query results to CSV, JSON Lines, Parquet or Arrow files, for
+the ``\\export`` special command, and bulk import of CSV and JSON Lines files
+into a table, for ``\\import``.
+
+Rows are fetched a batch at a time and written by a background thread, at
+most a few batches apart, so memory stays flat whatever the size of the
+result. A table can also be exported in partitions of its key read in
+parallel, each on a connection of its own. Imported files are read a line
+at a time and inserted a batch at a time with ``executemany``. Parquet and
+Arrow need the optional ``pyarrow`` package, zstd compression of CSV and
+JSON Lines the ``zstandard`` package (``pip install iterm[export]``).
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ("csv", "jsonl", "parquet", "arrow")
+IMPORT_FORMATS = ("csv", "jsonl")
+COMPRESSIONS = ("gzip", "zstd")
+
+# rows fetched from the server at a time
+BATCH_SIZE = 10000
+
+# batches fetched ahead of the writer, the most held in memory at once
+QUEUE_SIZE = 4
+
+# rows inserted by one executemany, and at most between two commits of an
+# import
+IMPORT_BATCH_SIZE = 1000
+COMMIT_EVERY = 100000
+
+
+class ExportResult(namedtuple("ExportResult", "rows seconds")):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+
+class ImportResult(namedtuple("ImportResult", "rows rejected seconds")):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+
+def compression_of(path):
+    """The compression implied by the extension of *path*, or None."""
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def format_of(path):
+    """The import format implied by the extension of *path*, or None.
+
+    >>> format_of("data.ndjson.gz")
+    'jsonl'
+    """
+    root, ext = os.path.splitext(path)
+    if ext in (".gz", ".zst"):
+        root, ext = os.path.splitext(root)
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    return None
+
+
+def open_input(path, compression=None):
+    """Open *path* for reading text, through *compression* if given."""
+    if compression == "gzip":
+        raw = gzip.open(path, "rb")
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd needs the zstandard package.")
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+    else:
+        raw = open(path, "rb")
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
+def open_output(path, compression=None):
+    """Open *path* for writing text, through *compression* if given."""
+    if compression == "gzip":
+        raw = gzip.open(path, "wb")
+    elif compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd needs the zstandard package.")
+        raw = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+    else:
+        raw = open(path, "wb")
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
+class CsvWriter(object):
+    def __init__(self, path, headers, compression=None, header=True):
+        self.stream = open_output(path, compression)
+        self.writer = csv.writer(self.stream)
+        if header:
+            self.writer.writerow(headers)
+
+    def write(self, batch):
+        self.writer.writerows(batch)
+
+    def close(self):
+        self.stream.close()
+
+
+class JsonlWriter(object):
+    def __init__(self, path, headers, compression=None):
+        self.stream = open_output(path, compression)
+        self.headers = headers
+        # dates, decimals and the like are written as their text
+        self.encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+
+    def write(self, batch):
+        encode = self.encoder.encode
+        headers = self.headers
+        self.stream.write(
+            "".join(encode(dict(zip(headers, row))) + "\n" for row in batch)
+        )
+
+    def close(self):
+        self.stream.close()
+
+
+class ArrowWriter(object):
+    """Writes Parquet, or with *ipc* an Arrow IPC file.
+
+    The schema is taken from the first batch. A batch that does not fit it,
+    with values in a column that was all NULL so far or fractions in an
+    integer column, goes to a part file with the widened schema, and the
+    parts are merged on close.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "t.parquet")
+    >>> writer = ArrowWriter(path, ["id", "note"])
+    >>> writer.write([(1, None), (2, None)])
+    >>> writer.write([(3, "x"), (4.5, None)])
+    >>> writer.close()
+    >>> table = pyarrow.parquet.read_table(path)
+    >>> [str(t) for t in table.schema.types], table.column("note").to_pylist()
+    (['double', 'string'], [None, None, 'x', None])
+    >>> os.listdir(os.path.dirname(path))
+    ['t.parquet']
+    """
+
+    def __init__(self, path, headers, compression=None, ipc=False):
+        if pyarrow is None:
+            raise RuntimeError("Parquet and Arrow need the pyarrow package.")
+        if ipc and compression == "gzip":
+            raise ValueError("Arrow files are compressed with zstd only.")
+        self.path = path
+        self.headers = headers
+        self.compression = compression
+        self.ipc = ipc
+        self.schema = None
+        self.writer = None
+        self.parts = []
+
+    def write(self, batch):
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(column) for column in zip(*batch)], names=self.headers
+        )
+        if self.writer is None:
+            self._open(table.schema)
+        elif table.schema != self.schema:
+            schema = unify_schemas([self.schema, table.schema])
+            if schema != self.schema:
+                self.writer.close()
+                self._open(schema)
+            table = table.cast(schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            # an empty result still gets a file, with untyped columns
+            self._open(pyarrow.schema([(name, pyarrow.null()) for name in self.headers]))
+        self.writer.close()
+        if len(self.parts) == 1:
+            os.replace(self.parts[0], self.path)
+        else:
+            format = "arrow" if self.ipc else "parquet"
+            merge_parts(format, self.parts, self.path, self.compression)
+
+    def _open(self, schema):
+        self.schema = schema
+        path = part_path(self.path, len(self.parts))
+        self.parts.append(path)
+        if self.ipc:
+            options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+            self.writer = pyarrow.ipc.new_file(path, schema, options=options)
+        else:
+            self.writer = pyarrow.parquet.ParquetWriter(
+                path, schema, compression=self.compression or "snappy"
+            )
+
+
+def unify_schemas(schemas):
+    """The schema all of *schemas* can be cast to: a NULL column takes the
+    type of the others, and with pyarrow 14 or later numbers are widened,
+    integers to floats and decimals to the larger precision and scale."""
+    try:
+        return pyarrow.unify_schemas(schemas, promote_options="permissive")
+    except TypeError:
+        # pyarrow before 14 only fills in NULL columns
+        return pyarrow.unify_schemas(schemas)
+
+
+def writer_for(format, path, headers, compression=None, header=True):
+    """A writer of *format*; *header* False leaves out the header line of a
+    CSV file, one that is appended to another."""
+    if format == "csv":
+        return CsvWriter(path, headers, compression, header)
+    if format == "jsonl":
+        return JsonlWriter(path, headers, compression)
+    if format in ("parquet", "arrow"):
+        return ArrowWriter(path, headers, compression, ipc=format == "arrow")
+    raise ValueError("Unknown format %r, use one of %s." % (format, ", ".join(FORMATS)))
+
+
+def export_rows(
+    cursor, writer, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, progress=None
+):
+    """Write the result of *cursor* with *writer*, fetching *batch_size* rows
+    at a time while a background thread writes the batches before them.
+    *progress* is called with the rows fetched so far after every batch.
+    Closes the writer and returns an :class:`ExportResult`.
+
+    >>> import os, sqlite3, tempfile
+    >>> cursor = sqlite3.connect(":memory:").execute(
+    ...     "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5)"
+    ...     " SELECT x, 'row ' || x FROM n"
+    ... )
+    >>> path = os.path.join(tempfile.mkdtemp(), "n.jsonl.gz")
+    >>> writer = writer_for("jsonl", path, ["x", "name"], compression_of(path))
+    >>> export_rows(cursor, writer, batch_size=2).rows
+    5
+    >>> gzip.open(path, "rt").readline()
+    '{"x": 1, "name": "row 1"}\\n'
+    """
+    batches = queue.Queue(queue_size)
+    errors = []
+
+    def write():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if errors:
+                # keep taking batches, so the fetch does not block on a full queue
+                continue
+            try:
+                writer.write(batch)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=write, name="export_writer")
+    thread.daemon = True
+    thread.start()
+
+    start = time.monotonic()
+    rows = 0
+    try:
+        while not errors:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            rows += len(batch)
+            batches.put(batch)
+            if progress is not None:
+                progress(rows)
+    finally:
+        batches.put(None)
+        thread.join()
+        writer.close()
+    if errors:
+        raise errors[0]
+    return ExportResult(rows, time.monotonic() - start)
+
+
+class Partition(namedtuple("Partition", "index low high last")):
+    """The rows of a table whose key is from *low* up to *high*, *high*
+    itself only in the *last* partition."""
+
+    def where(self, key):
+        return "%s >= ? AND %s %s ?" % (key, key, "<=" if self.last else "<")
+
+
+def split_range(low, high, count):
+    """Split the keys from *low* to *high* into *count* ranges of about the
+    same width; fewer if there are fewer keys.
+
+    >>> [tuple(p) for p in split_range(1, 10, 3)]
+    [(0, 1, 4, False), (1, 4, 7, False), (2, 7, 10, True)]
+    >>> [tuple(p) for p in split_range(1, 2, 2)]
+    [(0, 1, 2, False), (1, 2, 2, True)]
+    >>> len(split_range(1, 2, 4))
+    2
+    >>> [tuple(p) for p in split_range(0.0, 1.0, 2)]
+    [(0, 0.0, 0.5, False), (1, 0.5, 1.0, True)]
+    """
+    if not isinstance(low, (int, float)) or not isinstance(high, (int, float)):
+        raise ValueError("Partitions need a numeric key, not %r." % (low,))
+    if isinstance(low, int) and isinstance(high, int):
+        # integer steps over the high - low + 1 keys, the last range ends
+        # at high, included
+        count = max(1, min(count, high - low + 1))
+        bounds = [low + i * (high - low + 1) // count for i in range(count)]
+        bounds.append(high)
+    else:
+        bounds = [low + (high - low) * i / count for i in range(count + 1)]
+    return [
+        Partition(i, bounds[i], bounds[i + 1], i == count - 1) for i in range(count)
+    ]
+
+
+def part_path(path, index):
+    """The file partition *index* of an export to *path* is written to.
+
+    >>> part_path("/tmp/orders.csv.gz", 2)
+    '/tmp/orders.part-0003.csv.gz'
+    """
+    root, ext = os.path.splitext(path)
+    if ext in (".gz", ".zst"):
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return "%s.part-%04d%s" % (root, index + 1, ext)
+
+
+def merge_parts(format, parts, path, compression=None):
+    """Join the files *parts* into *path*, in order, and remove them. CSV and
+    JSON Lines files, compressed or not, are concatenated as they are; the
+    row groups of Parquet and the batches of Arrow files are copied."""
+    if format in ("csv", "jsonl"):
+        with open(path, "wb") as out:
+            for part in parts:
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out)
+    elif format == "parquet":
+        files = [pyarrow.parquet.ParquetFile(part) for part in parts]
+        schema = unify_schemas([f.schema_arrow for f in files])
+        writer = pyarrow.parquet.ParquetWriter(
+            path, schema, compression=compression or "snappy"
+        )
+        for f in files:
+            for i in range(f.num_row_groups):
+                writer.write_table(f.read_row_group(i).cast(schema))
+        writer.close()
+    else:
+        readers = [pyarrow.ipc.open_file(part) for part in parts]
+        schema = unify_schemas([r.schema for r in readers])
+        options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+        writer = pyarrow.ipc.new_file(path, schema, options=options)
+        for r in readers:
+            for i in range(r.num_record_batches):
+                writer.write_table(pyarrow.Table.from_batches([r.get_batch(i)]).cast(schema))
+        writer.close()
+    for part in parts:
+        os.unlink(part)
+
+
+def export_partitions(
+    pool,
+    table,
+    format,
+    path,
+    partitions=4,
+    key="%ID",
+    compression=None,
+    merge=False,
+    workers=None,
+    batch_size=BATCH_SIZE,
+    progress=None,
+):
+    """Export *table* split by *key* into *partitions* ranges, each read on
+    a connection of *pool* by one of *workers* threads, into a part file of
+    its own; with *merge* the parts are then joined into *path*.
+
+    *progress* is called with the partition, its rows so far and whether it
+    is done, from the thread reading it. Returns an :class:`ExportResult`
+    and the files written.
+
+    >>> import sqlite3, tempfile
+    >>> from iterm.connpool import ConnectionPool
+    >>> db = os.path.join(tempfile.mkdtemp(), "n.db")
+    >>> with sqlite3.connect(db) as conn:
+    ...     _ = conn.execute("CREATE TABLE n (x INTEGER)")
+    ...     _ = conn.executemany("INSERT INTO n VALUES (?)", [(i,) for i in range(1, 11)])
+    >>> pool = ConnectionPool(lambda: sqlite3.connect(db, check_same_thread=False))
+    >>> path = os.path.join(os.path.dirname(db), "n.csv")
+    >>> result, files = export_partitions(pool, "n", "csv", path, 3, key="x")
+    >>> result.rows, [os.path.basename(f) for f in files]
+    (10, ['n.part-0001.csv', 'n.part-0002.csv', 'n.part-0003.csv'])
+    >>> result, files = export_partitions(pool, "n", "csv", path, 3, key="x", merge=True)
+    >>> open(path).read().split()
+    ['x', '1', '2', '3', '4', '5', '6', '7', '8', '9', '10']
+    """
+    start = time.monotonic()
+    conn = pool.acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(%s), MAX(%s) FROM %s" % (key, key, table))
+        low, high = cursor.fetchone()
+        cursor.close()
+    finally:
+        pool.release(conn)
+    if low is None:
+        # an empty table still gets a file
+        conn = pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM %s WHERE 1 = 0" % table)
+            headers = [x[0] for x in cursor.description]
+            export_rows(cursor, writer_for(format, path, headers, compression))
+        finally:
+            pool.release(conn)
+        return ExportResult(0, time.monotonic() - start), [path]
+
+    ranges = split_range(low, high, partitions)
+    files = [part_path(path, p.index) for p in ranges]
+
+    def export(partition):
+        conn = pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM %s WHERE %s" % (table, partition.where(key)),
+                (partition.low, partition.high),
+            )
+            headers = [x[0] for x in cursor.description]
+            if progress is not None:
+                progress(partition, 0, False)
+            # only the first part of a merged file has the header line
+            writer = writer_for(
+                format,
+                files[partition.index],
+                headers,
+                compression,
+                header=not merge or partition.index == 0,
+            )
+            report = None
+            if progress is not None:
+                report = lambda rows: progress(partition, rows, False)
+            result = export_rows(cursor, writer, batch_size, progress=report)
+            cursor.close()
+        except Exception:
+            pool.discard(conn)
+            raise
+        pool.release(conn)
+        if progress is not None:
+            progress(partition, result.rows, True)
+        return result.rows
+
+    with ThreadPoolExecutor(workers or len(ranges), "export_partition") as executor:
+        rows = sum(executor.map(export, ranges))
+    if merge:
+        merge_parts(format, files, path, compression)
+        files = [path]
+    return ExportResult(rows, time.monotonic() - start), files
+
+
+class CsvReader(object):
+    """The rows of a CSV file, its first line naming the columns. Empty
+    fields are read as NULL."""
+
+    def __init__(self, path, compression=None):
+        self.stream = open_input(path, compression)
+        self.reader = csv.reader(self.stream)
+        self.names = next(self.reader, [])
+
+    def __iter__(self):
+        """Yield ``(raw, values)``, *values* being an error message for a row
+        that cannot be imported."""
+        width = len(self.names)
+        for row in self.reader:
+            if len(row) != width:
+                yield row, "expected %d fields, found %d" % (width, len(row))
+            else:
+                yield row, [value if value != "" else None for value in row]
+
+    def rejects(self, path):
+        return CsvRejects(path, self.names)
+
+    def close(self):
+        self.stream.close()
+
+
+class JsonlReader(object):
+    """The objects of a JSON Lines file, its first object naming the
+    columns. Keys the first object does not have are not imported."""
+
+    def __init__(self, path, compression=None):
+        self.stream = open_input(path, compression)
+        self.first = None
+        for line in self.stream:
+            if line.strip():
+                self.first = line
+                break
+        self.names = list(self._decode(self.first)) if self.first else []
+
+    def __iter__(self):
+        names = self.names
+        lines = self.stream if self.first is None else _chain(self.first, self.stream)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = self._decode(line)
+            except ValueError as e:
+                yield line, "invalid JSON: %s" % e
+                continue
+            yield line, [record.get(name) for name in names]
+
+    def rejects(self, path):
+        return JsonlRejects(path)
+
+    def close(self):
+        self.stream.close()
+
+    @staticmethod
+    def _decode(line):
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("not an object")
+        return record
+
+
+def _chain(first, rest):
+    yield first
+    for line in rest:
+        yield line
+
+
+def reader_for(format, path, compression=None):
+    if format == "csv":
+        return CsvReader(path, compression)
+    if format == "jsonl":
+        return JsonlReader(path, compression)
+    raise ValueError(
+        "Unknown format %r, use one of %s." % (format, ", ".join(IMPORT_FORMATS))
+    )
+
+
+class CsvRejects(object):
+    """Rows that could not be imported, as they were read with the error in
+    an added column, which an import of the fixed file ignores. The file is
+    only created for the first rejected row."""
+
+    def __init__(self, path, names):
+        self.path = path
+        self.names = names
+        self.count = 0
+        self.stream = None
+
+    def write(self, raw, error):
+        if self.stream is None:
+            self.stream = open_output(self.path)
+            self.writer = csv.writer(self.stream)
+            self.writer.writerow(self.names + ["error"])
+        self.writer.writerow(list(raw) + [error])
+        self.count += 1
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+
+class JsonlRejects(CsvRejects):
+    """Lines that could not be imported, with the error in an added
+    ``_error`` key, or in an object of their own text if they are not
+    JSON."""
+
+    def __init__(self, path):
+        CsvRejects.__init__(self, path, None)
+
+    def write(self, raw, error):
+        if self.stream is None:
+            self.stream = open_output(self.path)
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            record = {"_line": raw.rstrip("\r\n")}
+        record["_error"] = error
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.count += 1
+
+
+def rejects_path(path):
+    """Where the rejected rows of an import of *path* go.
+
+    >>> rejects_path("/tmp/data.csv.gz")
+    '/tmp/data.rejects.csv'
+    """
+    root, ext = os.path.splitext(path)
+    if ext in (".gz", ".zst"):
+        root, ext = os.path.splitext(root)
+    return root + ".rejects" + ext
+
+
+def table_columns(cursor, table):
+    """The column names of *table*, as the server spells them."""
+    cursor.execute("SELECT * FROM %s WHERE 1 = 0" % table)
+    columns = [x[0] for x in cursor.description]
+    cursor.fetchall()
+    return columns
+
+
+class Transaction(object):
+    """The statements an import commits with, and sets a savepoint before
+    every batch with, so a failed batch can be undone and retried row by
+    row."""
+
+    begin = "START TRANSACTION"
+    commit = "COMMIT"
+    rollback = "ROLLBACK"
+    savepoint = "SAVEPOINT import_batch"
+    rollback_to = "ROLLBACK TO SAVEPOINT import_batch"
+    # drops the savepoint of a batch once it is done, None where savepoints
+    # last until the transaction ends, as in IRIS
+    release = None
+    # savepoints a transaction can hold, the import commits before it has more
+    max_savepoints = 255
+
+
+def import_rows(
+    cursor,
+    table,
+    reader,
+    rejects,
+    batch_size=IMPORT_BATCH_SIZE,
+    commit_every=COMMIT_EVERY,
+    transaction=Transaction,
+):
+    """Insert the rows of *reader* into *table*, *batch_size* rows per
+    ``executemany`` and committed every *commit_every* rows.
+
+    Columns of the file are matched to those of the table by name, ignoring
+    case; those the table does not have are left out. A batch that fails is
+    rolled back to its savepoint and inserted again one row at a time, the
+    rows which still fail are written to *rejects* with their error, as are
+    rows that cannot be read. Closes *rejects* and returns an
+    :class:`ImportResult`.
+
+    >>> import os, sqlite3, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "n.csv")
+    >>> _ = open(path, "w").write("ID,Name,Extra\\n1,one,x\\n2,two\\n1,again,y\\n3,,z\\n")
+    >>> conn = sqlite3.connect(":memory:", isolation_level=None)
+    >>> _ = conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    >>> class SQLite(Transaction):
+    ...     begin = "BEGIN"
+    >>> reader = reader_for("csv", path)
+    >>> result = import_rows(conn.cursor(), "t", reader, reader.rejects(rejects_path(path)),
+    ...                      batch_size=2, transaction=SQLite)
+    >>> result.rows, result.rejected
+    (2, 2)
+    >>> conn.execute("SELECT * FROM t").fetchall()
+    [(1, 'one'), (3, None)]
+    >>> for line in open(rejects_path(path)).read().splitlines():
+    ...     print(line)
+    ID,Name,Extra,error
+    2,two,"expected 3 fields, found 2"
+    1,again,y,UNIQUE constraint failed: t.id
+
+    Without ``release`` every batch leaves its savepoint until the next
+    commit, so an import of many small batches commits before there are
+    more than ``max_savepoints``:
+
+    >>> class Cursor(object):
+    ...     description = [("ID",)]
+    ...     depth = deepest = 0
+    ...     def execute(self, sql, values=None):
+    ...         if sql.startswith("SAVEPOINT"):
+    ...             self.depth += 1
+    ...             self.deepest = max(self.deepest, self.depth)
+    ...         elif sql == "COMMIT":
+    ...             self.depth = 0
+    ...     def executemany(self, sql, rows):
+    ...         pass
+    ...     def fetchall(self):
+    ...         return []
+    >>> _ = open(path, "w").write("ID\\n" + "".join("%d\\n" % i for i in range(600)))
+    >>> cursor = Cursor()
+    >>> reader = reader_for("csv", path)
+    >>> import_rows(cursor, "t", reader, reader.rejects(rejects_path(path)),
+    ...             batch_size=1).rows
+    600
+    >>> cursor.deepest
+    255
+    """
+    start = time.monotonic()
+    columns = {name.upper(): name for name in table_columns(cursor, table)}
+    mapped = [
+        (i, columns[name.upper()])
+        for i, name in enumerate(reader.names)
+        if name.upper() in columns
+    ]
+    if not mapped:
+        reader.close()
+        raise ValueError("No column of the file is a column of %s." % table)
+    indexes = [i for i, _ in mapped]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        table,
+        ", ".join(name for _, name in mapped),
+        ", ".join("?" * len(mapped)),
+    )
+
+    rows = 0
+    uncommitted = 0
+    # savepoints held by the transaction
+    savepoints = 0
+    batch = []
+    raws = []
+
+    def insert():
+        cursor.execute(transaction.savepoint)
+        try:
+            cursor.executemany(sql, batch)
+            inserted = len(batch)
+        except Exception:
+            cursor.execute(transaction.rollback_to)
+            inserted = 0
+            for raw, values in zip(raws, batch):
+                try:
+                    cursor.execute(sql, values)
+                    inserted += 1
+                except Exception as e:
+                    rejects.write(raw, str(e))
+        if transaction.release:
+            cursor.execute(transaction.release)
+        return inserted
+
+    cursor.execute(transaction.begin)
+    try:
+        for raw, values in reader:
+            if isinstance(values, str):
+                rejects.write(raw, values)
+                continue
+            batch.append([values[i] for i in indexes])
+            raws.append(raw)
+            if len(batch) < batch_size:
+                continue
+            inserted = insert()
+            rows += inserted
+            uncommitted += inserted
+            if not transaction.release:
+                savepoints += 1
+            batch, raws = [], []
+            if uncommitted >= commit_every or savepoints >= transaction.max_savepoints:
+                cursor.execute(transaction.commit)
+                cursor.execute(transaction.begin)
+                uncommitted = savepoints = 0
+        if batch:
+            rows += insert()
+        cursor.execute(transaction.commit)
+    except BaseException:
+        # the rows of the last commits stay in the table
+        try:
+            cursor.execute(transaction.rollback)
+        except Exception:
+            pass
+        raise
+    finally:
+        reader.close()
+        rejects.close()
+    return ImportResult(rows, rejects.count, time.monotonic() - start)
@@ -23,6 +23,13 @@ def create_toolbar_tokens_func(cli):
             result.append(("class:bottom-toolbar.on", "[F3] Multiline: ON  "))
         else:
             result.append(("class:bottom-toolbar.off", "[F3] Multiline: OFF  "))
+        if cli.query is not None and cli.query.running:
+            result.append(
+                (
+                    "class:bottom-toolbar.on",
+                    "Running {0:.1f}s [Ctrl-C] Cancel  ".format(cli.query.elapsed),
+                )
+            )
         if cli.prompt_app.editing_mode == EditingMode.VI:
             result.append(
                 ("class:botton-toolbar.on", "Vi-mode ({})".format(_get_vi_mode()))
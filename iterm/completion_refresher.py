@@ -57,7 +57,8 @@ class CompletionRefresher(object):
         completer = SQLCompleter(**completer_options)
 
         e = sqlexecute
-        # Create a new sqlexecute method to populate the completions.
+        # Create a new sqlexecute method to populate the completions, on a
+        # connection from the pool shared with the prompt.
         executor = SQLExecute(
             hostname=e.hostname,
             port=e.port,
@@ -73,20 +74,23 @@ class CompletionRefresher(object):
         if callable(callbacks):
             callbacks = [callbacks]
 
-        while 1:
-            for refresher in self.refreshers.values():
-                refresher(completer, executor)
-                if self._restart_refresh.is_set():
-                    self._restart_refresh.clear()
+        try:
+            while 1:
+                for refresher in self.refreshers.values():
+                    refresher(completer, executor)
+                    if self._restart_refresh.is_set():
+                        self._restart_refresh.clear()
+                        break
+                else:
+                    # Break out of while loop if the for loop finishes naturally
+                    # without hitting the break statement.
                     break
-            else:
-                # Break out of while loop if the for loop finishes naturally
-                # without hitting the break statement.
-                break
-
-            # Start over the refresh from the beginning if the for loop hit the
-            # break statement.
-            continue
+
+                # Start over the refresh from the beginning if the for loop hit the
+                # break statement.
+                continue
+        finally:
+            executor.close()
 
         for callback in callbacks:
             callback(completer)
@@ -0,0 +1,194 @@
+"""
+DB-API connections shared by the foreground prompt, the completion refresher
+and background commands, so none of them pays the connect (and TLS
+handshake) of its own.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+_logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of at most *max_size* connections made by *connect*.
+
+    Idle connections are handed out most recently used first. One idle for
+    more than *max_idle* seconds is closed, down to *min_size* open ones; one
+    idle for more than *check_after* seconds is checked with *ping* first
+    and replaced by a new connection if it has died. :meth:`acquire` waits up
+    to *timeout* seconds for a connection when all are in use.
+
+    >>> import sqlite3
+    >>> pool = ConnectionPool(lambda: sqlite3.connect(":memory:"), max_size=1)
+    >>> conn = pool.acquire()
+    >>> pool.release(conn)
+    >>> pool.acquire() is conn
+    True
+    >>> pool.acquire(timeout=0)
+    Traceback (most recent call last):
+    ...
+    iterm.connpool.PoolTimeout: All 1 connections are in use.
+    """
+
+    def __init__(
+        self,
+        connect,
+        min_size=1,
+        max_size=4,
+        max_idle=300,
+        check_after=30,
+        timeout=30,
+        ping="SELECT 1",
+    ):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        self.ping = ping
+        # (connection, monotonic time it was released), most recent last
+        self.idle = deque()
+        # open connections, idle or in use
+        self.size = 0
+        self.cond = threading.Condition()
+        self.stats = {
+            "connects": 0,
+            "reuses": 0,
+            "reconnects": 0,
+            "evictions": 0,
+            "waits": 0,
+            "connect_seconds": 0.0,
+        }
+
+    def acquire(self, timeout=None):
+        """Return a live connection, hand it back with :meth:`release`."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                self._evict()
+                if self.idle:
+                    conn, released = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    conn = released = None
+                    break
+                self.stats["waits"] += 1
+                left = deadline - time.monotonic()
+                if left <= 0 or not self.cond.wait(left):
+                    raise PoolTimeout(
+                        "All %d connections are in use." % self.max_size
+                    )
+
+        if conn is None:
+            try:
+                return self._open()
+            except Exception:
+                with self.cond:
+                    self.size -= 1
+                    self.cond.notify()
+                raise
+        if time.monotonic() - released > self.check_after and not self.alive(conn):
+            _logger.info("Pooled connection is dead, reconnecting.")
+            self.stats["reconnects"] += 1
+            self._close(conn)
+            try:
+                return self._open()
+            except Exception:
+                with self.cond:
+                    self.size -= 1
+                    self.cond.notify()
+                raise
+        self.stats["reuses"] += 1
+        return conn
+
+    def release(self, conn):
+        with self.cond:
+            self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+
+    def discard(self, conn):
+        """Close a connection that is known to be broken, instead of
+        releasing it."""
+        self._close(conn)
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.ping)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def available(self):
+        """The connections :meth:`acquire` can hand out without waiting."""
+        with self.cond:
+            return self.max_size - self.size + len(self.idle)
+
+    def metrics(self):
+        with self.cond:
+            stats = dict(self.stats, size=self.size, idle=len(self.idle))
+        return stats
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = self.idle, deque()
+            self.size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _open(self):
+        start = time.monotonic()
+        conn = self.connect()
+        self.stats["connects"] += 1
+        self.stats["connect_seconds"] += time.monotonic() - start
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict(self):
+        # the least recently used idle connections are at the left
+        now = time.monotonic()
+        while (
+            self.idle
+            and self.size > self.min_size
+            and now - self.idle[0][1] > self.max_idle
+        ):
+            conn, _ = self.idle.popleft()
+            self.size -= 1
+            self.stats["evictions"] += 1
+            self._close(conn)
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def shared(params, connect, **kwargs):
+    """Return the process wide pool for the connection parameters *params*,
+    created with *connect* and *kwargs* on first use."""
+    key = tuple(sorted((name, repr(value)) for name, value in params.items()))
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(connect, **kwargs)
+    return pool
@@ -0,0 +1,147 @@
+"""
+Runs the same commands in many sessions at once, one per namespace or
+instance, for ``iterm fanout``.
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .irissession import PROMPT, IRISSession
+from .relay import text_decoder
+from .script import ScriptRunner
+
+Target = namedtuple("Target", "name cmd")
+
+
+class TargetResult(
+    namedtuple("TargetResult", "target commands failed error output seconds")
+):
+    """Outcome of the script on one target, *error* is its first error."""
+
+    @property
+    def status(self):
+        return 0 if self.error is None else 1
+
+
+class PrefixWriter(object):
+    """Writes the output of one target to a shared stream, every line
+    prefixed with the target name. Lines of different targets interleave,
+    but are never mixed."""
+
+    def __init__(self, name, stream, lock):
+        self.prefix = "[%s] " % name
+        self.stream = stream
+        self.lock = lock
+        self.line = ""
+        self.decoder = text_decoder()
+
+    def write(self, output):
+        output = self.decoder.decode(output)
+        lines = (self.line + output.replace("\r", "")).split("\n")
+        self.line = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.stream.write(self.prefix + line + "\n")
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def close(self):
+        if self.line:
+            self.write(b"\n")
+            self.flush()
+
+
+class BufferWriter(object):
+    """Keeps the output of one target, for the summary."""
+
+    def __init__(self):
+        self.parts = []
+        self.decoder = text_decoder()
+
+    def write(self, output):
+        self.parts.append(self.decoder.decode(output))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts).replace("\r", "")
+
+
+def run_target(target, lines, output, timeout=None, stop_on_error=True, prompt=PROMPT):
+    start = time.monotonic()
+    deadline = start + timeout if timeout else None
+    commands = failed = 0
+    error = None
+    session = None
+    try:
+        session = IRISSession.start(target.cmd, prompt)
+        # the banner is not part of the output
+        for _ in session.read_until_prompt(timeout or 30):
+            pass
+        if session.prompted is None:
+            raise RuntimeError("no prompt from %s" % target.name)
+        runner = ScriptRunner(session, output=output, deadline=deadline)
+        for result in runner.run(lines, stop_on_error):
+            commands += 1
+            if result.error is not None:
+                failed += 1
+                error = error or result.error
+    except Exception as e:
+        error = error or str(e)
+    finally:
+        output.close()
+        if session is not None:
+            session.close()
+    text = output.getvalue() if isinstance(output, BufferWriter) else None
+    return TargetResult(
+        target, commands, failed, error, text, time.monotonic() - start
+    )
+
+
+def fanout(
+    targets,
+    lines,
+    workers=8,
+    timeout=None,
+    stop_on_error=True,
+    stream=None,
+    prompt=PROMPT,
+):
+    """Run *lines* on every target, at most *workers* at a time, and yield
+    a :class:`TargetResult` as each one finishes.
+
+    With a *stream* the output goes there as it arrives, prefixed with the
+    target name; otherwise it is kept in the results. *timeout* limits the
+    time on each target, from the start of its session.
+    """
+    lines = list(lines)
+    lock = threading.Lock()
+
+    def output(target):
+        if stream is None:
+            return BufferWriter()
+        return PrefixWriter(target.name, stream, lock)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                run_target,
+                target,
+                lines,
+                output(target),
+                timeout,
+                stop_on_error,
+                prompt,
+            )
+            for target in targets
+        ]
+        for future in as_completed(futures):
+            yield future.result()
@@ -1,10 +1,18 @@
+import asyncio
 import os
+import re
+import shlex
 import sys
 import pty
+import fcntl
+import struct
 import subprocess
+import termios
 import time
 import select
 
+from .relay import InputQueue, PtyReader, text_decoder
+
 def read_and_forward_pty_output(fd):
     max_read_bytes = 1024 * 20
     while True:
@@ -17,29 +25,116 @@ def read_and_forward_pty_output(fd):
         output = os.read(fd, max_read_bytes).decode(errors="ignore")
         # print(output)
 
-def command():
+def command(namespace=None):
     # return ["iris", "session", "iris"]
     import iris
     bin = iris.system.Util.BinaryDirectory() + "irisdb"
-    mgr = "-s" + iris.system.Util.ManagerDirectory()
-    return [bin, mgr]
+    mgr = iris.system.Util.ManagerDirectory()
+    cmd = [bin, "-s", mgr]
+    if namespace:
+        cmd += ["-U", namespace]
+    return cmd
+
+
+# the terminal prompt at the end of the output: the namespace, with the
+# transaction level before it and the stack level after it, when not zero
+# (USER>, %SYS>, TL1:USER>, USER 2d0>)
+PROMPT = r"(?:^|\r*\n)(?:TL\d+:)?%?[\w.-]+(?: \d+[a-z]\d+)?>\s?$"
+
+
+class PromptScanner(object):
+    """Looks for the prompt at the end of the output, fed one read at a time.
+
+    Only the last *size* characters are searched, so a long output costs no
+    rescans.
+
+    >>> scanner = PromptScanner(re.compile(PROMPT))
+    >>> scanner.feed("write 1\\r\\n1\\r\\nUS")
+    ('write 1\\r\\n1\\r\\nUS', None)
+    >>> scanner.feed("ER>")
+    ('', 'USER>')
+
+    Fed bytes, it returns a slice of the same buffer and the prompt as bytes.
+    """
+
+    def __init__(self, pattern, size=256):
+        self.pattern = pattern
+        self.size = size
+        self.tail = None
+
+    def feed(self, output):
+        """Return the output before the prompt and the prompt, or the output
+        and None while there is no prompt. The part of a prompt that arrived
+        with an earlier read has already been returned as output."""
+        if self.tail is None:
+            self.tail = "" if isinstance(output, str) else b""
+            if not isinstance(output, str):
+                self.pattern = re.compile(self.pattern.pattern.encode())
+        self.tail = (self.tail + output[-self.size :])[-self.size :]
+        match = self.pattern.search(self.tail)
+        if not match:
+            return output, None
+        end = len(output) - (len(self.tail) - match.start())
+        self.tail = None
+        return output[: max(0, end)], match.group().strip()
+
+
+def _pidfd(pid):
+    # a fd that turns readable when the child exits, Linux 5.3+, Python 3.9+
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def _on_tty(cmd, tty):
+    # the child of start_new_session opens its pty by name, which makes it
+    # its controlling terminal, so ^C and window size changes reach it; a
+    # shell does it, preexec_fn is not safe in a process with threads
+    tty = shlex.quote(tty)
+    if isinstance(cmd, str):
+        return "exec <>%s >&0 2>&0; %s" % (tty, cmd)
+    return "exec <>%s >&0 2>&0; exec %s" % (tty, shlex.join(cmd))
 
 class IRISSession():
-    max_read_bytes = 1024
+    # the read size grows with the output, up to max_read_bytes
+    max_read_bytes = 256 * 1024
+    min_read_bytes = 1024
+    # output kept to look for the prompt, longer than any prompt
+    prompt_tail = 256
 
-    def __init__(self, pid, fd) -> None:
+    def __init__(self, pid, fd, proc=None, prompt=PROMPT) -> None:
         self.pid = pid
         self.fd = fd
+        self.proc = proc
+        self.started = time.monotonic()
+        self.decoder = text_decoder()
+        # the pty is non-blocking, input waits here until it can be written
+        self.input = InputQueue(fd)
+        self.reader = PtyReader(fd, self.max_read_bytes, self.min_read_bytes)
+        self.prompt = re.compile(prompt)
+        # the last prompt seen by read_until_prompt()
+        self.prompted = None
+        # the exit status once the child has been reaped, negative for a signal
+        self.returncode = None
+        # readable once the child exits, None where there is no pidfd: then
+        # exited() reaps with a non-blocking waitpid
+        self.exit_fd = _pidfd(pid) if proc is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     @staticmethod
-    def start(cmd=None):
+    def start(cmd=None, prompt=PROMPT):
         cmd = cmd if cmd else command()
 
-        print('pid', os.getpid())
         master_fd, slave_fd = pty.openpty()
 
         proc = subprocess.Popen(
-            cmd,
+            _on_tty(cmd, os.ttyname(slave_fd)),
             stdin=slave_fd,
             stdout=slave_fd,
             stderr=slave_fd,
@@ -47,41 +142,280 @@ class IRISSession():
             shell=True,
             start_new_session=True,
         )
-        return IRISSession(proc.pid, master_fd)
+        os.close(slave_fd)
+        os.set_blocking(master_fd, False)
+        return IRISSession(proc.pid, master_fd, proc, prompt)
 
+    def read(self, timeout_sec = 0):
+        data = self.read_bytes(timeout_sec)
+        if data is None:
+            return
 
-        (child_pid, fd) = pty.fork()
-        print('fork', child_pid, fd)
-        if child_pid == 0:
-            proc = subprocess.Popen(cmd if cmd else command())
-            print('child', proc.pid)
-        else:
-            print('main')
-            return IRISSession(child_pid, fd)
+        return self.decoder.decode(data)
 
-    def read(self, timeout_sec = 0):
+    def read_bytes(self, timeout_sec=0):
+        """Like :meth:`read`, undecoded. The result is a view of the read
+        buffer, only valid until the next read."""
         if not self.fd:
             return
         (data_ready, _, _) = select.select([self.fd], [], [], timeout_sec)
         if not data_ready:
             return
 
-        return os.read(self.fd, self.max_read_bytes).decode(errors="ignore")
+        return self.reader.read()
+
+    def read_until_prompt(self, timeout=1, binary=False):
+        """Yield output until it ends with the prompt, or nothing arrived for
+        *timeout* seconds, when the routine waits for input. The prompt itself
+        is kept out of the output and left in ``prompted``. With *binary*
+        the output is yielded as views of the read buffer."""
+        self.prompted = None
+        scanner = PromptScanner(self.prompt, self.prompt_tail)
+        read = self.read_bytes if binary else self.read
+        while self.prompted is None:
+            output = read(timeout)
+            if not output:
+                return
+            output, prompted = scanner.feed(output)
+            if isinstance(prompted, bytes):
+                prompted = prompted.decode(errors="replace")
+            self.prompted = prompted
+            if output:
+                yield output
 
     def write(self, input: str):
         if not self.fd:
             return
 
-        os.write(self.fd, input.encode())
+        self.input.put(input)
+        self.flush_input()
 
-    def alive(self):
+    def flush_input(self, timeout=None):
+        """Write queued input as the pty accepts it, waiting at most *timeout*
+        seconds for it to become writable. Returns the bytes still queued."""
+        while self.input:
+            (_, writable, _) = select.select([], [self.fd], [], timeout)
+            if not writable:
+                break
+            self.input.write()
+        return len(self.input)
+
+    # changes the size reported to TTY-aware applications like vim
+    def resize(self, rows, cols):
         if not self.fd:
             return
 
-        os.write(self.fd, input.encode())
+        winsize = struct.pack("HHHH", rows, cols, 0, 0)
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, winsize)
+
+    def drain(self, quiet=0.5, timeout=30):
+        """Discard output until the session has been quiet for *quiet*
+        seconds, or *timeout* seconds have passed."""
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline and self.read(quiet) is not None:
+                pass
+        except OSError:
+            # session ended
+            pass
+
+    def exited(self, timeout=0):
+        """Return True once the child has exited, waiting at most *timeout*
+        seconds for it; the child is reaped and its status is left in
+        ``returncode``. Relays select on ``exit_fd`` instead of calling this
+        on every turn."""
+        if self.returncode is not None or self.proc is None:
+            return self.returncode is not None
+        if self.exit_fd is not None:
+            (ready, _, _) = select.select([self.exit_fd], [], [], timeout)
+            if not ready:
+                return False
+        self.returncode = self.proc.poll()
+        return self.returncode is not None
+
+    def alive(self):
+        """True while the pty is open and the child has not exited."""
+        return self.fd is not None and self.running()
 
     def running(self):
-        if not self.fd:
+        """True while the child has not exited, a session without a child of
+        its own always runs."""
+        return self.proc is None or not self.exited()
+
+    def close(self):
+        """Stop and reap the child, then close the pty and the pidfd."""
+        if self.proc is not None and self.returncode is None:
+            if not self.exited():
+                self.proc.kill()
+            self.returncode = self.proc.wait()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.exit_fd is not None:
+            os.close(self.exit_fd)
+            self.exit_fd = None
+
+
+class AsyncIRISSession(object):
+    """An IRISSession for asyncio.
+
+    The pty is watched with ``loop.add_reader`` and its output goes to
+    ``stream``, an :class:`asyncio.StreamReader`; input is written with
+    ``loop.add_writer`` as the pty accepts it. Nothing polls, an idle session
+    costs no wakeups. The pty is read into the preallocated buffer of the
+    session's :class:`~iterm.relay.PtyReader`, which the stream copies from.
+
+        async with AsyncIRISSession() as session:
+            print(await session.execute("write $zversion"))
+    """
+
+    def __init__(self, cmd=None, prompt=PROMPT, session=None, limit=1024 * 64):
+        self.cmd = cmd
+        self.prompt = prompt
+        self.session = session
+        self.limit = limit
+        self.loop = None
+        self.stream = None
+        self.decoder = text_decoder()
+        self.writing = False
+        # the last prompt seen by read_until_prompt()
+        self.prompted = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.session is None:
+            self.session = IRISSession.start(self.cmd, self.prompt)
+        self.loop = asyncio.get_running_loop()
+        self.stream = asyncio.StreamReader(limit=self.limit)
+        # the stream pauses and resumes reading through the transport
+        # interface, a consumer that falls behind leaves the output in the pty
+        self.stream.set_transport(self)
+        self.resume_reading()
+
+    def pause_reading(self):
+        if self.session.fd is not None:
+            self.loop.remove_reader(self.session.fd)
+
+    def resume_reading(self):
+        if self.session.fd is not None and not self.stream.at_eof():
+            self.loop.add_reader(self.session.fd, self._readable)
+
+    def _readable(self):
+        try:
+            data = self.session.reader.read()
+        except BlockingIOError:
             return
+        except OSError:
+            # child is gone
+            data = b""
+        if data:
+            self.stream.feed_data(data)
+        else:
+            self.pause_reading()
+            self.stream.feed_eof()
+
+    async def read(self, timeout=None):
+        """Return the next output, "" at the end, None if nothing arrived
+        within *timeout* seconds."""
+        data = await self.read_bytes(timeout)
+        if data is None:
+            return None
+        return self.decoder.decode(data, final=not data)
+
+    async def read_bytes(self, timeout=None):
+        """Like :meth:`read`, undecoded."""
+        try:
+            return await asyncio.wait_for(self.stream.read(self.limit), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def read_until_prompt(self, timeout=1, binary=False):
+        """Async version of :meth:`IRISSession.read_until_prompt`, a *timeout*
+        of None waits for the prompt or the end of the session. With
+        *binary* the output is yielded as bytes."""
+        self.prompted = None
+        scanner = PromptScanner(self.session.prompt, self.session.prompt_tail)
+        read = self.read_bytes if binary else self.read
+        while self.prompted is None:
+            output = await read(timeout)
+            if not output:
+                return
+            output, prompted = scanner.feed(output)
+            if isinstance(prompted, bytes):
+                prompted = prompted.decode(errors="replace")
+            self.prompted = prompted
+            if output:
+                yield output
 
-        return
+    async def execute(self, command, timeout=1):
+        """Run *command* and return its output, without the echoed command."""
+        self.write(command + "\n")
+        output = "".join([output async for output in self.read_until_prompt(timeout)])
+        if output.startswith(command):
+            output = output[len(command) :].lstrip("\r\n")
+        return output
+
+    def write(self, input: str):
+        if self.session.fd is None:
+            return
+        self.session.input.put(input)
+        self._writable()
+
+    def _writable(self):
+        queue = self.session.input
+        try:
+            while queue and queue.write():
+                pass
+        except OSError:
+            # child is gone
+            del queue.buffer[:]
+        if queue and not self.writing:
+            self.loop.add_writer(self.session.fd, self._writable)
+            self.writing = True
+        elif not queue and self.writing:
+            self.loop.remove_writer(self.session.fd)
+            self.writing = False
+
+    def resize(self, rows, cols):
+        self.session.resize(rows, cols)
+
+    @property
+    def returncode(self):
+        return self.session.returncode
+
+    async def wait(self):
+        """Wait for the child to exit and return its exit status, None for a
+        session without a child of its own."""
+        session = self.session
+        if session.proc is None:
+            return None
+        if session.exit_fd is not None and not session.exited():
+            exited = self.loop.create_future()
+            self.loop.add_reader(
+                session.exit_fd, lambda: exited.done() or exited.set_result(None)
+            )
+            try:
+                await exited
+            finally:
+                self.loop.remove_reader(session.exit_fd)
+        while not session.exited():
+            # no pidfd to wait on
+            await asyncio.sleep(0.1)
+        return session.returncode
+
+    def close(self):
+        if self.session is None or self.session.fd is None:
+            return
+        self.pause_reading()
+        if self.writing:
+            self.loop.remove_writer(self.session.fd)
+            self.writing = False
+        self.session.close()
+        if not self.stream.at_eof():
+            self.stream.feed_eof()
@@ -1,7 +1,7 @@
 from __future__ import unicode_literals
 import logging
 from prompt_toolkit.enums import EditingMode
-from prompt_toolkit.filters import completion_is_selected
+from prompt_toolkit.filters import Condition, completion_is_selected
 from prompt_toolkit.key_binding import KeyBindings
 
 _logger = logging.getLogger(__name__)
@@ -27,6 +27,14 @@ def iterm_bindings(cli):
             event.app.editing_mode = EditingMode.VI
             cli.key_bindings = "vi"
 
+    query_running = Condition(lambda: cli.query is not None and cli.query.running)
+
+    @kb.add("c-c", filter=query_running)
+    def _(event):
+        """Cancel the running query, the prompt stays as it is."""
+        _logger.debug("Detected <C-c> key.")
+        cli.query.cancel()
+
     @kb.add("tab")
     def _(event):
         """Force autocompletion at cursor."""
@@ -0,0 +1,190 @@
+"""
+Per-session counters of the terminal relays, rendered as JSON or as
+Prometheus text.
+
+Each session has a single writer for its counters (its relay), so they are
+plain attributes updated without locks; readers take a snapshot.
+"""
+import time
+
+# upper bounds, in seconds, of the output latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+COUNTERS = ("bytes_in", "bytes_out", "pty_bytes", "reads", "frames")
+
+
+class SessionMetrics(object):
+    """Counters of one terminal session.
+
+    Output latency is the time from reading the first byte of a frame from
+    the pty to sending the frame to the client.
+
+    >>> m = SessionMetrics("s1")
+    >>> m.read(100, now=1.0)
+    >>> m.read(50, now=1.002)
+    >>> m.sent(150, now=1.004)
+    >>> s = m.snapshot(now=2.0)
+    >>> s["reads"], s["frames"], s["frame_avg"], s["latency"]["buckets"][:3]
+    (2, 1, 150.0, [0, 1, 0])
+    """
+
+    __slots__ = COUNTERS + ("id", "started", "input", "pending", "latency", "latency_sum")
+
+    def __init__(self, id, input=None):
+        self.id = id
+        self.started = time.monotonic()
+        # the session's InputQueue, its depth is read on snapshot
+        self.input = input
+        self.pending = None
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        for name in COUNTERS:
+            setattr(self, name, 0)
+
+    def received(self, size):
+        """Client input of *size* bytes."""
+        self.bytes_in += size
+
+    def read(self, size, now=None):
+        """A pty read of *size* bytes."""
+        self.reads += 1
+        self.pty_bytes += size
+        if self.pending is None:
+            self.pending = time.monotonic() if now is None else now
+
+    def sent(self, size, now=None):
+        """A frame of *size* bytes sent to the client."""
+        self.frames += 1
+        self.bytes_out += size
+        if self.pending is None:
+            return
+        now = time.monotonic() if now is None else now
+        latency = now - self.pending
+        self.pending = None
+        self.latency_sum += latency
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        self.latency[i] += 1
+
+    def changes(self):
+        """A value that changes whenever the counters of a snapshot do, so a
+        relay publishes only when there is something new.
+
+        >>> m = SessionMetrics("s1")
+        >>> before = m.changes()
+        >>> before == m.changes()
+        True
+        >>> m.received(3)
+        >>> before == m.changes()
+        False
+        """
+        return (
+            self.bytes_in,
+            self.reads,
+            self.frames,
+            len(self.input) if self.input is not None else 0,
+        )
+
+    def snapshot(self, now=None):
+        now = time.monotonic() if now is None else now
+        snapshot = {name: getattr(self, name) for name in COUNTERS}
+        snapshot["id"] = self.id
+        snapshot["age"] = round(now - self.started, 3)
+        snapshot["frame_avg"] = (
+            round(self.bytes_out / self.frames, 1) if self.frames else 0
+        )
+        snapshot["input_depth"] = len(self.input) if self.input is not None else 0
+        snapshot["latency"] = {"buckets": list(self.latency), "sum": self.latency_sum}
+        return snapshot
+
+
+class Registry(object):
+    """The sessions of one process, and the totals of the ones that ended."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.closed = dict.fromkeys(COUNTERS + ("sessions",), 0)
+        self.closed["latency"] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0}
+
+    def add(self, metrics):
+        self.sessions[metrics.id] = metrics
+        return metrics
+
+    def remove(self, metrics):
+        if self.sessions.pop(metrics.id, None) is None:
+            return
+        for name in COUNTERS:
+            self.closed[name] += getattr(metrics, name)
+        self.closed["sessions"] += 1
+        latency = self.closed["latency"]
+        latency["buckets"] = [a + b for a, b in zip(latency["buckets"], metrics.latency)]
+        latency["sum"] += metrics.latency_sum
+
+    def snapshot(self):
+        closed = dict(self.closed)
+        closed["latency"] = dict(closed["latency"])
+        return {
+            "sessions": [m.snapshot() for m in list(self.sessions.values())],
+            "closed": closed,
+        }
+
+
+def _totals(snapshot):
+    totals = {name: snapshot["closed"][name] for name in COUNTERS + ("sessions",)}
+    for session in snapshot["sessions"]:
+        for name in COUNTERS:
+            totals[name] += session[name]
+    return totals
+
+
+def prometheus(snapshot, prefix="iterm"):
+    """Render a :meth:`Registry.snapshot` in the Prometheus text format.
+
+    Counters are given per live session and as process totals, which
+    include the sessions that ended; sort by ``bytes_out`` or ``pty_bytes``
+    to find the heavy sessions.
+    """
+    lines = []
+    sessions = snapshot["sessions"]
+    totals = _totals(snapshot)
+
+    lines.append("# TYPE %s_sessions gauge" % prefix)
+    lines.append("%s_sessions %d" % (prefix, len(sessions)))
+    lines.append("# TYPE %s_sessions_closed_total counter" % prefix)
+    lines.append("%s_sessions_closed_total %d" % (prefix, totals["sessions"]))
+    for name in COUNTERS:
+        metric = "%s_%s_total" % (prefix, name)
+        lines.append("# TYPE %s counter" % metric)
+        lines.append("%s %d" % (metric, totals[name]))
+        lines.append("# TYPE %s_session_%s counter" % (prefix, name))
+        for session in sessions:
+            lines.append(
+                '%s_session_%s{session="%s"} %d'
+                % (prefix, name, session["id"], session[name])
+            )
+    for name in ("age", "frame_avg", "input_depth"):
+        lines.append("# TYPE %s_session_%s gauge" % (prefix, name))
+        for session in sessions:
+            lines.append(
+                '%s_session_%s{session="%s"} %s'
+                % (prefix, name, session["id"], session[name])
+            )
+
+    metric = "%s_output_latency_seconds" % prefix
+    lines.append("# TYPE %s histogram" % metric)
+    buckets = snapshot["closed"]["latency"]["buckets"]
+    latency_sum = snapshot["closed"]["latency"]["sum"]
+    for session in sessions:
+        latency = session["latency"]
+        buckets = [a + b for a, b in zip(buckets, latency["buckets"])]
+        latency_sum += latency["sum"]
+    count = 0
+    for bound, value in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+        count += value
+        lines.append('%s_bucket{le="%s"} %d' % (metric, bound, count))
+    lines.append("%s_sum %s" % (metric, latency_sum))
+    lines.append("%s_count %d" % (metric, count))
+    return "\n".join(lines) + "\n"
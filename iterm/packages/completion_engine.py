@@ -1,9 +1,13 @@
 from __future__ import print_function
+import re
 from sqlparse.sql import Comparison, Identifier, Where
 from .encodingutils import string_types, text_type
 from .parseutils import last_word, extract_tables, find_prev_keyword
 from .special import parse_special_command
 
+# an option of a special command and its value, --batch 1000
+_OPTION = re.compile(r"(?:^|\s)--\w+(?:\s+\S+)?")
+
 
 def suggest_type(full_text, text_before_cursor):
 
@@ -20,6 +24,13 @@ def suggest_special(text):
     if cmd in ["\\.", "source", ".open", ".read"]:
         return [{"type": "file_name"}]
 
+    if cmd in ["\\import", ".import"]:
+        # Usage: \import [--name value ...] file table
+        arg = _OPTION.sub("", arg)
+        if _expecting_arg_idx(arg, text) == 1:
+            return [{"type": "file_name"}]
+        return [{"type": "table", "schema": []}]
+
     return [{"type": "keyword"}, {"type": "special"}]
 
 
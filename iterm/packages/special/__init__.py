@@ -11,3 +11,4 @@ def export(defn):
 from .main import NO_QUERY, RAW_QUERY, PARSED_QUERY
 from . import dbcommands
 from . import iocommands
+from . import bulkcommands
@@ -0,0 +1,243 @@
+from __future__ import unicode_literals
+import logging
+import os
+import shlex
+import threading
+import time
+
+import click
+
+from iterm import bulk
+from . import export
+from .main import special_command, PARSED_QUERY
+
+log = logging.getLogger(__name__)
+
+# the connections of the current server, partitioned exports read on them
+connection_pool = None
+
+
+@export
+def set_connection_pool(pool):
+    global connection_pool
+    connection_pool = pool
+
+
+def parse_options(arg, options, positional):
+    """Split *arg* into ``--name value`` *options*, the first *positional*
+    words and the rest, which is left as it is. An option whose default is
+    False is a flag, ``--name`` alone sets it.
+
+    >>> parse_options("--batch 10 csv 'my file.csv' SELECT 1", {"batch": 0}, 2)
+    ({'batch': '10'}, ['csv', 'my file.csv'], 'SELECT 1')
+    >>> parse_options("--merge csv f t", {"merge": False}, 2)
+    ({'merge': True}, ['csv', 'f'], 't')
+    """
+    values = dict(options)
+    words = []
+    lexer = shlex.shlex(arg, posix=True)
+    lexer.whitespace_split = True
+    while len(words) < positional:
+        word = lexer.get_token()
+        if word is None:
+            break
+        if word.startswith("--") and word[2:] in options:
+            if options[word[2:]] is False:
+                values[word[2:]] = True
+            else:
+                values[word[2:]] = lexer.get_token()
+        else:
+            words.append(word)
+    rest = lexer.instream.read().strip()
+    return values, words, rest
+
+
+@special_command(
+    "\\export",
+    "\\export [--batch N] [--compress gzip|zstd] [--partitions N [--key column] [--merge]] "
+    "csv|jsonl|parquet|arrow file query|table",
+    "Export the result of a query, or a table in partitions, to a file.",
+    arg_type=PARSED_QUERY,
+    connection=True,
+    case_sensitive=True,
+)
+def export_query(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
+    options, words, query = parse_options(
+        arg or "",
+        {
+            "batch": bulk.BATCH_SIZE,
+            "compress": None,
+            "partitions": None,
+            "key": "%ID",
+            "merge": False,
+        },
+        2,
+    )
+    if len(words) < 2 or not query:
+        message = (
+            "Usage: \\export [--batch N] [--compress gzip|zstd] "
+            "[--partitions N [--key column] [--merge]] format file query|table"
+        )
+        return [(None, None, None, message)]
+    format, path = words[0].lower(), os.path.expanduser(words[1])
+    if format not in bulk.FORMATS:
+        message = "Unknown format %s, use one of %s." % (format, ", ".join(bulk.FORMATS))
+        return [(None, None, None, message)]
+    compression = options["compress"] or bulk.compression_of(path)
+    if compression not in (None,) + bulk.COMPRESSIONS:
+        return [(None, None, None, "Unknown compression %s." % compression)]
+
+    if options["partitions"]:
+        return export_partitions(query, format, path, compression, options)
+
+    log.debug(query)
+    cur.execute(query)
+    if not cur.description:
+        return [(None, None, None, "The query returned no result to export.")]
+    headers = [x[0] for x in cur.description]
+    writer = bulk.writer_for(format, path, headers, compression)
+    result = bulk.export_rows(cur, writer, int(options["batch"]))
+    return [(None, None, None, export_status(result, path))]
+
+
+def export_status(result, path, workers=None):
+    return "Exported {0} row{1} to {2} in {3:.2f}s, {4:,.0f} rows/s{5}.".format(
+        result.rows,
+        "" if result.rows == 1 else "s",
+        path,
+        result.seconds,
+        result.rows_per_second,
+        "" if workers is None else " on %d connections" % workers,
+    )
+
+
+def export_partitions(table, format, path, compression, options):
+    if connection_pool is None:
+        return [(None, None, None, "Not connected.")]
+    if len(table.split()) > 1:
+        return [(None, None, None, "Partitions are exported from a table, not a query.")]
+    partitions = int(options["partitions"])
+    # the foreground connection is in use, a worker waiting for a connection
+    # would wait for a whole partition to be read
+    workers = max(1, min(partitions, connection_pool.available()))
+    progress = PartitionProgress()
+    try:
+        result, files = bulk.export_partitions(
+            connection_pool,
+            table,
+            format,
+            path,
+            partitions,
+            key=options["key"],
+            compression=compression,
+            merge=options["merge"],
+            workers=workers,
+            batch_size=int(options["batch"]),
+            progress=progress,
+        )
+    finally:
+        progress.close()
+    where = files[0] if len(files) == 1 else "%d files, %s" % (len(files), files[0])
+    return [(None, None, None, export_status(result, where, workers))]
+
+
+class PartitionProgress(object):
+    """Shows the rows read of every running partition on one line of
+    stderr, rewritten at most every *interval* seconds, and a line of its
+    own for each partition when it is done."""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lock = threading.Lock()
+        # index of a running partition -> (rows read, monotonic time started)
+        self.running = {}
+        self.shown = 0
+        self.line = 0
+
+    def __call__(self, partition, rows, done):
+        now = time.monotonic()
+        with self.lock:
+            started = self.running.get(partition.index, (0, now))[1]
+            if done:
+                self.running.pop(partition.index, None)
+                self.write(
+                    "Partition {0}: {1:,} rows in {2:.2f}s.\n".format(
+                        partition.index + 1, rows, now - started
+                    )
+                )
+            else:
+                self.running[partition.index] = (rows, started)
+                if now - self.shown < self.interval:
+                    return
+            self.shown = now
+            self.write(
+                "  ".join(
+                    "{0}: {1:,}".format(index + 1, rows)
+                    for index, (rows, _) in sorted(self.running.items())
+                )
+            )
+
+    def write(self, text):
+        # clear what was left of the running line first
+        click.echo("\r" + " " * self.line + "\r" + text, err=True, nl=False)
+        self.line = 0 if text.endswith("\n") else len(text)
+
+    def close(self):
+        if self.line:
+            self.write("")
+
+
+@special_command(
+    "\\import",
+    "\\import [--batch N] [--commit N] [--rejects file] [--format csv|jsonl] file table",
+    "Insert the rows of a CSV or JSON Lines file into a table.",
+    arg_type=PARSED_QUERY,
+    connection=True,
+    case_sensitive=True,
+    aliases=(".import",),
+)
+def import_file(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
+    options, words, rest = parse_options(
+        arg or "",
+        {
+            "batch": bulk.IMPORT_BATCH_SIZE,
+            "commit": bulk.COMMIT_EVERY,
+            "rejects": None,
+            "format": None,
+        },
+        2,
+    )
+    if len(words) < 2 or rest:
+        message = (
+            "Usage: \\import [--batch N] [--commit N] [--rejects file] "
+            "[--format csv|jsonl] file table"
+        )
+        return [(None, None, None, message)]
+    path, table = os.path.expanduser(words[0]), words[1]
+    format = options["format"] or bulk.format_of(path)
+    if format not in bulk.IMPORT_FORMATS:
+        message = "Cannot tell the format of %s, give --format csv|jsonl." % path
+        return [(None, None, None, message)]
+    rejects_path = os.path.expanduser(options["rejects"] or bulk.rejects_path(path))
+
+    reader = bulk.reader_for(format, path, bulk.compression_of(path))
+    result = bulk.import_rows(
+        cur,
+        table,
+        reader,
+        reader.rejects(rejects_path),
+        int(options["batch"]),
+        int(options["commit"]),
+    )
+    status = "Imported {0} row{1} into {2} in {3:.2f}s, {4:,.0f} rows/s.".format(
+        result.rows,
+        "" if result.rows == 1 else "s",
+        table,
+        result.seconds,
+        result.rows_per_second,
+    )
+    if result.rejected:
+        status += " {0} rejected row{1} written to {2}.".format(
+            result.rejected, "" if result.rejected == 1 else "s", rejects_path
+        )
+    return [(None, None, None, status)]
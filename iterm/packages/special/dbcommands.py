@@ -12,6 +12,7 @@ log = logging.getLogger(__name__)
     "\\ds [schema]",
     "List schemas.",
     arg_type=PARSED_QUERY,
+    connection=True,
     case_sensitive=True,
     aliases=("\\ds",),
 )
@@ -53,6 +54,7 @@ def list_schemas(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
     "\\dt [schema]",
     "List tables.",
     arg_type=PARSED_QUERY,
+    connection=True,
     case_sensitive=True,
     aliases=("\\dt",),
 )
@@ -93,6 +95,7 @@ def list_tables(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
     "\\ts",
     "Start a Database Transaction.",
     arg_type=PARSED_QUERY,
+    connection=True,
     case_sensitive=True,
     aliases=("\\ts",),
 )
@@ -112,6 +115,7 @@ def start_db_transaction(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
     "\\tc",
     "Commit a Database Transaction.",
     arg_type=PARSED_QUERY,
+    connection=True,
     case_sensitive=True,
     aliases=("\\tc",),
 )
@@ -131,6 +135,7 @@ def commit_db_transaction(cur, arg=None, arg_type=PARSED_QUERY, verbose=False):
     "\\tr",
     "Rollback a Database Transaction.",
     arg_type=PARSED_QUERY,
+    connection=True,
     case_sensitive=True,
     aliases=("\\tr",),
 )
@@ -20,7 +20,10 @@ SpecialCommand = namedtuple(
         "arg_type",
         "hidden",
         "case_sensitive",
+        # runs on the SQL connection, the others need none
+        "connection",
     ],
+    defaults=(False,),
 )
 
 COMMANDS = {}
@@ -53,6 +56,7 @@ def special_command(
     hidden=False,
     case_sensitive=False,
     aliases=(),
+    connection=False,
 ):
     def wrapper(wrapped):
         register_special_command(
@@ -64,6 +68,7 @@ def special_command(
             hidden,
             case_sensitive,
             aliases,
+            connection,
         )
         return wrapped
 
@@ -80,10 +85,18 @@ def register_special_command(
     hidden=False,
     case_sensitive=False,
     aliases=(),
+    connection=False,
 ):
     cmd = command.lower() if not case_sensitive else command
     COMMANDS[cmd] = SpecialCommand(
-        handler, command, shortcut, description, arg_type, hidden, case_sensitive
+        handler,
+        command,
+        shortcut,
+        description,
+        arg_type,
+        hidden,
+        case_sensitive,
+        connection,
     )
     for alias in aliases:
         cmd = alias.lower() if not case_sensitive else alias
@@ -95,9 +108,28 @@ def register_special_command(
             arg_type,
             case_sensitive=case_sensitive,
             hidden=True,
+            connection=connection,
         )
 
 
+@export
+def is_command(sql):
+    """True if *sql* starts with a special command."""
+    command = parse_special_command(sql)[0]
+    if command in COMMANDS:
+        return True
+    special_cmd = COMMANDS.get(command.lower())
+    return special_cmd is not None and not special_cmd.case_sensitive
+
+
+@export
+def needs_connection(sql):
+    """True if the special command *sql* runs on the SQL connection."""
+    command = parse_special_command(sql)[0]
+    special_cmd = COMMANDS.get(command) or COMMANDS.get(command.lower())
+    return special_cmd is not None and special_cmd.connection
+
+
 @export
 def execute(cur, sql):
     """Execute a special command and return the results. If the special command
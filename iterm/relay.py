@@ -0,0 +1,424 @@
+"""
+Helpers shared by the terminal relays (the Django/socket.io app in
+``iterm.xterm`` and the ``iTerm.Engine`` CSP websocket), which forward
+pty output to a browser.
+"""
+import codecs
+import os
+import select
+import socket
+import threading
+import time
+
+
+def text_decoder():
+    """Return a stateful utf-8 decoder, which keeps a multibyte character
+    split across two reads instead of mangling it.
+
+    >>> decoder = text_decoder()
+    >>> data = "ё".encode()
+    >>> decoder.decode(data[:1]), decoder.decode(data[1:])
+    ('', 'ё')
+    """
+    return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class PtyReader(object):
+    """Reads pty output into one preallocated buffer.
+
+    With a *min_read_bytes* the read size adapts to the output: it doubles
+    after a read that filled it, up to *max_read_bytes*, and halves after a
+    read that used less than a quarter of it, so a bulk output takes few
+    large reads and typing echo stays in a small, cache friendly buffer.
+
+    >>> r, w = os.pipe()
+    >>> reader = PtyReader(r, max_read_bytes=16, min_read_bytes=4)
+    >>> _ = os.write(w, b"x" * 20)
+    >>> [len(reader.read()) for _ in range(3)], reader.size
+    ([4, 8, 8], 16)
+    >>> reader.drained
+    True
+    """
+
+    def __init__(self, fd, max_read_bytes=1024 * 20, min_read_bytes=None):
+        self.fd = fd
+        self.buffer = bytearray(max_read_bytes)
+        self.view = memoryview(self.buffer)
+        self.max_read_bytes = max_read_bytes
+        self.min_read_bytes = min_read_bytes or max_read_bytes
+        self.size = self.min_read_bytes
+        # False after a read that filled the read size, more is likely ready
+        self.drained = True
+
+    def read(self):
+        """Read what the pty has ready, empty at end of file.
+
+        The result is a view of the shared buffer, it is only valid until the
+        next read.
+        """
+        size = self.size
+        count = os.readv(self.fd, [self.view[:size]])
+        self.drained = count < size
+        if not self.drained:
+            self.size = min(size * 2, self.max_read_bytes)
+        elif count < size // 4:
+            self.size = max(size // 2, self.min_read_bytes)
+        return self.view[:count]
+
+
+class InputQueue(object):
+    """Client input waiting to be written to a non-blocking pty.
+
+    Input is queued and written in chunks of at most *chunk* bytes whenever
+    the pty is writable, so a large paste never blocks the relay. Keystrokes
+    arriving while earlier input is still queued go out with it, in one write.
+
+    >>> r, w = os.pipe()
+    >>> os.set_blocking(w, False)
+    >>> q = InputQueue(w, chunk=4)
+    >>> q.put("abc")
+    >>> q.put("def")
+    >>> len(q)
+    6
+    >>> q.write(), len(q)
+    (4, 2)
+    >>> q.write(), os.read(r, 10)
+    (2, b'abcdef')
+    >>> q.stats["max_depth"], q.stats["writes"]
+    (6, 2)
+    """
+
+    def __init__(self, fd, chunk=4096):
+        self.fd = fd
+        self.chunk = chunk
+        self.buffer = bytearray()
+        self.stats = {"queued": 0, "written": 0, "writes": 0, "max_depth": 0}
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def put(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.buffer += data
+        self.stats["queued"] += len(data)
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self.buffer))
+
+    def write(self):
+        """Write the next chunk, return the bytes written, 0 if the pty is full."""
+        if not self.buffer:
+            return 0
+        try:
+            size = os.write(self.fd, self.buffer[: self.chunk])
+        except BlockingIOError:
+            return 0
+        del self.buffer[:size]
+        self.stats["written"] += size
+        self.stats["writes"] += 1
+        return size
+
+
+class OutputCoalescer(object):
+    """Collects pty output into fewer, larger frames.
+
+    Output is held back until either ``max_bytes`` are buffered or
+    ``max_delay`` seconds have passed since the first buffered byte. The
+    first output after :meth:`mark_input` is flushed immediately, so typing
+    echo is not delayed.
+
+    >>> c = OutputCoalescer(max_bytes=4, max_delay=10)
+    >>> c.feed(b"ab")
+    False
+    >>> c.feed(b"cd")
+    True
+    >>> c.flush()
+    b'abcd'
+    >>> c.mark_input()
+    >>> c.feed(b"e")
+    True
+    """
+
+    def __init__(self, max_bytes=16384, max_delay=0.008):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.buffer = bytearray()
+        self.deadline = None
+        self.echo = False
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def mark_input(self):
+        """Flush the next output as soon as it arrives."""
+        self.echo = True
+
+    def feed(self, data, now=None):
+        """Buffer *data* and return True if the buffer should be flushed."""
+        if not self.buffer:
+            now = time.monotonic() if now is None else now
+            self.deadline = now + self.max_delay
+        self.buffer += data
+        return self.due(now)
+
+    def due(self, now=None):
+        if not self.buffer:
+            return False
+        if self.echo or len(self.buffer) >= self.max_bytes:
+            return True
+        now = time.monotonic() if now is None else now
+        return now >= self.deadline
+
+    def timeout(self, now=None):
+        """Seconds until the buffered output is due, None if nothing is buffered."""
+        if not self.buffer:
+            return None
+        if self.echo:
+            return 0
+        now = time.monotonic() if now is None else now
+        return max(0, self.deadline - now)
+
+    def flush(self):
+        data = bytes(self.buffer)
+        del self.buffer[:]
+        self.deadline = None
+        self.echo = False
+        return data
+
+
+class FlowControl(object):
+    """Watermark based flow control between the pty and a client.
+
+    The client acknowledges the bytes it has consumed. Once more than *high*
+    bytes are unacknowledged the relay is paused and stops reading the pty,
+    so the kernel pty buffer holds the producer back; it resumes when no more
+    than *low* bytes are left unacknowledged.
+
+    >>> flow = FlowControl(high=10, low=4)
+    >>> flow.sent(12)
+    >>> flow.paused
+    True
+    >>> flow.acked(6)
+    False
+    >>> flow.acked(4)
+    True
+    >>> flow.paused
+    False
+    """
+
+    def __init__(self, high=256 * 1024, low=64 * 1024):
+        self.high = high
+        self.low = low
+        self.unacked = 0
+        self.paused = False
+
+    def sent(self, size):
+        self.unacked += size
+        if self.unacked >= self.high:
+            self.paused = True
+
+    def acked(self, size):
+        """Returns True if this acknowledgement resumed the relay."""
+        self.unacked = max(0, self.unacked - size)
+        if self.paused and self.unacked <= self.low:
+            self.paused = False
+            return True
+        return False
+
+
+class ScrollbackRing(object):
+    """The most recent output of a session in a preallocated ring buffer.
+
+    Every byte has a stream offset that only grows, so a reconnecting client
+    can ask for everything after the last offset it has seen. Only the last
+    *capacity* bytes are kept.
+
+    >>> ring = ScrollbackRing(8)
+    >>> ring.write(b"hello ")
+    >>> ring.write(b"world")
+    >>> ring.end
+    11
+    >>> ring.since(6)
+    (6, b'world')
+    >>> ring.since(0)
+    (3, b'lo world')
+    """
+
+    def __init__(self, capacity=256 * 1024):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.end = 0
+
+    @property
+    def start(self):
+        """Offset of the oldest byte still in the ring."""
+        return max(0, self.end - self.capacity)
+
+    def write(self, data):
+        size = len(data)
+        data = memoryview(data)[-self.capacity :]
+        pos = (self.end + size - len(data)) % self.capacity
+        head = min(len(data), self.capacity - pos)
+        self.buffer[pos : pos + head] = data[:head]
+        self.buffer[: len(data) - head] = data[head:]
+        self.end += size
+
+    def since(self, offset):
+        """Return ``(offset, data)`` with the output after *offset*; the
+        returned offset is later than asked for if that part was overwritten."""
+        offset = min(max(offset, self.start), self.end)
+        pos = offset % self.capacity
+        size = self.end - offset
+        head = min(size, self.capacity - pos)
+        return offset, bytes(self.buffer[pos : pos + head] + self.buffer[: size - head])
+
+
+class PtyWatcher(object):
+    """Waits on a session pty on a thread of its own, for a relay that can
+    only wait on its client.
+
+    The thread reads the pty output into a buffer, writes queued input as the
+    pty takes it, and watches the ``exit_fd`` of the session. Whenever output
+    comes into an empty buffer, or the session ends, it wakes the relay with a
+    byte on a loopback connection, which the relay waits on together with its
+    client. The relay connects to :attr:`port` and then calls :meth:`watch`.
+
+    Reading stops while :attr:`paused`, and while *limit* bytes wait to be
+    taken, so the pty buffer holds the producer back.
+
+    >>> class Session(object):
+    ...     def __init__(self, fd):
+    ...         self.fd, self.exit_fd, self.input = fd, None, InputQueue(fd)
+    >>> r, w = os.pipe()
+    >>> watcher = PtyWatcher()
+    >>> wake = socket.create_connection(("127.0.0.1", watcher.port))
+    >>> watcher.watch(Session(r))
+    >>> _ = os.write(w, b"job done")
+    >>> wake.recv(1), watcher.take()
+    (b'.', b'job done')
+    >>> os.close(w)
+    >>> _ = wake.recv(1)
+    >>> watcher.ended, watcher.take()
+    (True, b'')
+    >>> watcher.close()
+    """
+
+    def __init__(self, limit=65536, max_read_bytes=1024 * 20):
+        self.limit = limit
+        self.max_read_bytes = max_read_bytes
+        self.session = None
+        self.reader = None
+        # the session process ended, or its pty was closed
+        self.ended = False
+        self.paused = False
+        self.output = bytearray()
+        self.lock = threading.Lock()
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.wake = None
+        # wakes the thread when the relay changes what it waits for
+        (self._control, self._poke) = os.pipe()
+        self._closed = False
+        self.thread = None
+
+    def watch(self, session):
+        """Watch *session* from now on, or nothing with None."""
+        if self.wake is None:
+            self.listener.settimeout(5)
+            (self.wake, _) = self.listener.accept()
+            self.listener.close()
+            self.thread = threading.Thread(target=self._run, name="pty_watcher")
+            self.thread.daemon = True
+            self.thread.start()
+        with self.lock:
+            self.session = session
+            self.reader = (
+                PtyReader(session.fd, self.max_read_bytes) if session else None
+            )
+            self.ended = False
+            del self.output[:]
+        self.poke()
+
+    def put(self, data):
+        """Queue input for the pty, the thread writes it."""
+        self.session.input.put(data)
+        self.poke()
+
+    def pause(self, paused):
+        if paused != self.paused:
+            self.paused = paused
+            self.poke()
+
+    def take(self):
+        """Return the output read so far."""
+        with self.lock:
+            data = bytes(self.output)
+            del self.output[:]
+        if len(data) >= self.limit:
+            self.poke()
+        return data
+
+    def poke(self):
+        os.write(self._poke, b".")
+
+    def close(self):
+        self._closed = True
+        self.poke()
+        if self.thread is not None:
+            self.thread.join()
+        for f in (self.wake, self.listener):
+            if f is not None:
+                f.close()
+        os.close(self._control)
+        os.close(self._poke)
+
+    def _run(self):
+        while not self._closed:
+            session = self.session
+            rlist = [self._control]
+            wlist = []
+            if session is not None and not self.ended:
+                if not self.paused and len(self.output) < self.limit:
+                    rlist.append(session.fd)
+                if session.exit_fd is not None:
+                    rlist.append(session.exit_fd)
+                if session.input:
+                    wlist.append(session.fd)
+            (readable, writable, _) = select.select(rlist, wlist, [])
+            if self._control in readable:
+                os.read(self._control, 512)
+            if session is not self.session:
+                continue
+            try:
+                if writable:
+                    session.input.write()
+                wake = False
+                if session.fd in readable:
+                    wake = self._read(session)
+                if session.exit_fd in readable:
+                    # the rest of the output is in the pty already
+                    while self._read(session) is not None:
+                        pass
+                    self.ended = wake = True
+            except OSError:
+                # the pty is closed
+                self.ended = wake = True
+            if wake:
+                self.wake.send(b".")
+
+    def _read(self, session):
+        """Read what the pty has ready; returns True if the buffer was empty,
+        None if nothing was read."""
+        try:
+            data = self.reader.read()
+        except BlockingIOError:
+            return None
+        if not data:
+            raise OSError("end of file")
+        with self.lock:
+            if session is not self.session:
+                return None
+            empty = not self.output
+            self.output += data
+        return empty
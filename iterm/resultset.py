@@ -0,0 +1,231 @@
+"""
+Result sets read from the server one batch at a time, so a large result is
+shown as it arrives and never held in memory as a whole.
+"""
+import queue
+import threading
+
+
+class ResultRows(object):
+    """Iterates the rows of *cursor*, fetched *arraysize* at a time.
+
+    ``rowcount`` counts the rows fetched so far and is final once ``done``.
+    The cursor is closed, or handed to *release* instead, when the rows run
+    out, or by :meth:`close` when the reader stops early.
+
+    >>> import sqlite3
+    >>> cursor = sqlite3.connect(":memory:").execute(
+    ...     "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5)"
+    ...     " SELECT x FROM n"
+    ... )
+    >>> rows = ResultRows(cursor, arraysize=2)
+    >>> next(rows), rows.rowcount, str(rows.status)
+    ((1,), 2, '2 rows in set')
+    >>> list(rows), rows.done, str(rows.status)
+    ([(2,), (3,), (4,), (5,)], True, '5 rows in set')
+    """
+
+    def __init__(self, cursor, arraysize=1000, release=None):
+        self.cursor = cursor
+        self.arraysize = arraysize
+        self.release = release
+        self.rowcount = 0
+        self.done = False
+        self._rows = self._fetch()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._rows)
+
+    def _fetch(self):
+        try:
+            while True:
+                batch = self.cursor.fetchmany(self.arraysize)
+                if not batch:
+                    break
+                self.rowcount += len(batch)
+                yield from batch
+            self.done = True
+        finally:
+            self._close_cursor()
+
+    @property
+    def status(self):
+        return RowCountStatus(self)
+
+    def close(self):
+        """Stop reading, the rest of the result is dropped."""
+        self._rows.close()
+        self._close_cursor()
+
+    def _close_cursor(self):
+        if self.cursor is not None:
+            cursor, self.cursor = self.cursor, None
+            if self.release is not None:
+                self.release(cursor)
+            else:
+                cursor.close()
+
+
+class RowCountStatus(object):
+    """The "N rows in set" status of :class:`ResultRows`, its text is final
+    once the rows have been read."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __str__(self):
+        count = self.rows.rowcount
+        return "{0} row{1} in set".format(count, "" if count == 1 else "s")
+
+
+class TableStream(object):
+    """An ascii table of a result written a batch of rows at a time: the
+    header and borders once, as the ``ascii`` format of cli_helpers draws
+    them. The column widths are set by the headers and the first batch, a
+    longer value later on widens only its own line.
+
+    >>> table = TableStream(["id", "name"])
+    >>> print("\\n".join(table.lines([(1, "a"), (2, None)])))
+    +----+--------+
+    | id | name   |
+    +----+--------+
+    | 1  | a      |
+    | 2  | <null> |
+    >>> print("\\n".join(table.lines([(30, "a longer name")])))
+    | 30 | a longer name |
+    >>> print("\\n".join(table.end()))
+    +----+--------+
+    """
+
+    def __init__(self, headers, missing_value="<null>"):
+        self.headers = [str(header) for header in headers]
+        self.missing_value = missing_value
+        self.widths = None
+
+    def lines(self, rows):
+        """The lines of *rows*, after the header if they are the first."""
+        rows = [self._strings(row) for row in rows]
+        if self.widths is None:
+            self.widths = [
+                max(len(value) for value in column)
+                for column in zip(self.headers, *rows)
+            ]
+            yield self._border()
+            yield self._line(self.headers)
+            yield self._border()
+        for row in rows:
+            yield self._line(row)
+
+    def end(self):
+        """The bottom border, if a row has been written."""
+        if self.widths is not None:
+            yield self._border()
+
+    def _strings(self, row):
+        return [self.missing_value if value is None else str(value) for value in row]
+
+    def _border(self):
+        return "+" + "+".join("-" * (width + 2) for width in self.widths) + "+"
+
+    def _line(self, values):
+        return (
+            "| "
+            + " | ".join(value.ljust(width) for value, width in zip(values, self.widths))
+            + " |"
+        )
+
+
+class ResultPager(object):
+    """Pages the lines of a result that are written a batch at a time, from
+    the thread that fetches them.
+
+    The lines are held while they fit in *rows* lines of *columns*; a result
+    that ends there goes to *echo* a line at a time. Once they do not fit,
+    *spawn* is handed a function to run on a thread of its own, which passes
+    an iterator of all the lines to *page*. :meth:`write` then waits while
+    the pager is *backlog* batches behind, so a result is not held in memory,
+    and returns False once the pager has quit.
+
+    >>> import itertools, threading
+    >>> def spawn(run):
+    ...     threading.Thread(target=run).start()
+    >>> paged = []
+    >>> def page(lines):
+    ...     paged.extend(itertools.islice(lines, 3))  # quits after 3 lines
+    >>> pager = ResultPager(page, spawn, print, rows=2, columns=80)
+    >>> pager.write(["a", "b"])
+    True
+    >>> pager.write(["c", "d"])
+    True
+    >>> all(pager.write([str(n)]) for n in range(100))
+    False
+    >>> pager.close()
+    >>> paged
+    ['a', 'b', 'c']
+
+    A result that fits is not paged.
+
+    >>> pager = ResultPager(page, spawn, print, rows=2, columns=80)
+    >>> pager.write(["x"]), pager.close()
+    x
+    (True, None)
+    """
+
+    def __init__(self, page, spawn, echo, rows, columns, backlog=2):
+        self.page = page
+        self.spawn = spawn
+        self.echo = echo
+        self.rows = rows
+        self.columns = columns
+        self.held = []
+        self.batches = None
+        self.backlog = backlog
+        self.quit = threading.Event()
+
+    def write(self, lines):
+        """Page *lines*, False if the pager has quit."""
+        if self.batches is None:
+            self.held.extend(lines)
+            if len(self.held) <= self.rows and all(
+                len(line) <= self.columns for line in lines
+            ):
+                return True
+            # does not fit, start the pager with what has been held
+            lines, self.held = self.held, []
+            self.batches = queue.Queue(self.backlog)
+            self.spawn(self._run)
+        return self._put(lines)
+
+    def close(self):
+        """End of the result."""
+        if self.batches is None:
+            for line in self.held:
+                self.echo(line)
+            self.held = []
+        else:
+            self._put(None)
+
+    def _put(self, batch):
+        while not self.quit.is_set():
+            try:
+                self.batches.put(batch, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        try:
+            self.page(self._lines())
+        finally:
+            self.quit.set()
+
+    def _lines(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            yield from batch
@@ -0,0 +1,140 @@
+"""
+Statements run on a worker thread, so the prompt stays live while a query
+runs and Ctrl-C can cancel it.
+"""
+import itertools
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class RunningQuery(object):
+    """Runs *text* with *sqlexecute* on a worker thread.
+
+    The results are handed to *show* as ``(title, rows, headers, status)``
+    while they come: the rows of a query in batches of
+    ``sqlexecute.arraysize`` as they are fetched, with no status, then its
+    status with no rows. What has been shown of a query that is cancelled
+    stays on the screen. Errors go to *error*.
+
+    >>> import sqlite3
+    >>> class Execute(object):
+    ...     arraysize = 2
+    ...     def run(self, text):
+    ...         cursor = sqlite3.connect(":memory:").execute(text)
+    ...         yield None, cursor, ["x"], "done", text, True, False
+    >>> shown = []
+    >>> query = RunningQuery(Execute(), "SELECT 1 UNION SELECT 2 UNION SELECT 3",
+    ...                      lambda *result: shown.append(result), print)
+    >>> query.wait(5)
+    True
+    >>> [rows for _, rows, _, _ in shown]
+    [[(1,), (2,)], [(3,)], None]
+    """
+
+    def __init__(self, sqlexecute, text, show, error):
+        self.sqlexecute = sqlexecute
+        self.text = text
+        self.show = show
+        self.error = error
+        self.started = time.monotonic()
+        self.finished = None
+        self.cancelled = False
+        # rows shown so far
+        self.rowcount = 0
+        self._canceller = None
+        self._done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="query")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def running(self):
+        return not self._done.is_set()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def wait(self, timeout=None):
+        """Wait for the statement to end, True if it has."""
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        """Stop the statement, returns at once.
+
+        The worker stops fetching before its next batch and closes the
+        cursor; the statement is stopped on the server by
+        ``sqlexecute.cancel`` on a thread of its own, since it may wait for a
+        side connection.
+        """
+        if self.cancelled or not self.running:
+            return
+        self.cancelled = True
+        self._canceller = threading.Thread(
+            target=self.sqlexecute.cancel, name="query_cancel"
+        )
+        self._canceller.daemon = True
+        self._canceller.start()
+
+    def _run(self):
+        try:
+            for title, rows, headers, status, _, success, _ in self.sqlexecute.run(
+                self.text
+            ):
+                if not success:
+                    # SQLExecute.run yields an error in place of the status
+                    self.error(status)
+                    continue
+                self._show(title, rows, headers, status)
+                if self.cancelled:
+                    break
+        except Exception as e:
+            if not self.cancelled:
+                _logger.error("Query failed: %r", e)
+                self.error(e)
+        finally:
+            self.finished = time.monotonic()
+            if self.cancelled:
+                self._cleanup()
+            self._done.set()
+
+    def _show(self, title, rows, headers, status):
+        if rows is None:
+            self.show(title, None, headers, status)
+            return
+        size = getattr(self.sqlexecute, "arraysize", 1000)
+        fetched = iter(rows)
+        try:
+            while not self.cancelled:
+                batch = list(itertools.islice(fetched, size))
+                if not batch:
+                    break
+                self.show(title, batch, headers, None)
+                self.rowcount += len(batch)
+                title = None
+        finally:
+            close = getattr(rows, "close", None)
+            if self.cancelled and close is not None:
+                close()
+        self.show(None, None, None, status)
+
+    def _cleanup(self):
+        # the connection the statement was cancelled on may be gone, wait for
+        # the cancel before a new one replaces it
+        self._canceller.join()
+        self.show(
+            None,
+            None,
+            None,
+            "Cancelled after {0:.2f}s, {1} row{2} shown.".format(
+                self.elapsed, self.rowcount, "" if self.rowcount == 1 else "s"
+            ),
+        )
+        try:
+            self.sqlexecute.reconnect()
+        except Exception as e:
+            _logger.error("Reconnecting after a cancel failed: %r", e)
+            self.error(e)
@@ -0,0 +1,189 @@
+"""
+Server side model of a terminal screen, for clients on slow links.
+
+Instead of every escape sequence a program writes, the client gets the cells
+that changed since the last update, at most once per interval. Needs the
+optional ``pyte`` package (``pip install iterm[screen]``).
+"""
+import time
+
+try:
+    import pyte
+    from pyte import graphics
+except ImportError:
+    pyte = None
+
+if pyte:
+    _FG = {name: code for code, name in graphics.FG_ANSI.items()}
+    _FG.update({name: code for code, name in graphics.FG_AIXTERM.items()})
+    _BG = {name: code for code, name in graphics.BG_ANSI.items()}
+    _BG.update({name: code for code, name in graphics.BG_AIXTERM.items()})
+
+
+def _color(color, names, extended):
+    if color == "default":
+        return None
+    if color in names:
+        return str(names[color])
+    # 256 and true colors are kept by pyte as hex rgb
+    try:
+        r, g, b = int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+    except ValueError:
+        return None
+    return "%d;2;%d;%d;%d" % (extended, r, g, b)
+
+
+def _sgr(char):
+    codes = ["0"]
+    if char.bold:
+        codes.append("1")
+    if char.italics:
+        codes.append("3")
+    if char.underscore:
+        codes.append("4")
+    if getattr(char, "blink", False):
+        codes.append("5")
+    if char.reverse:
+        codes.append("7")
+    if char.strikethrough:
+        codes.append("9")
+    fg = _color(char.fg, _FG, 38)
+    if fg:
+        codes.append(fg)
+    bg = _color(char.bg, _BG, 48)
+    if bg:
+        codes.append(bg)
+    return "\x1b[" + ";".join(codes) + "m"
+
+
+_PLAIN = "\x1b[0m"
+_BLANK = (" ", _PLAIN)
+
+# unchanged cells between two changed ones are drawn again, rather than
+# moving the cursor over them, when there are at most this many
+_GAP = 6
+
+
+class ScreenModel(object):
+    """A VT screen fed with pty output, flushed as an escape sequence that
+    draws the cells which differ from what the client was last sent.
+
+    It can stand in for :class:`iterm.relay.OutputCoalescer`: updates are
+    due at most every *interval* seconds, or right away after input, so
+    typing echo is not delayed.
+
+    >>> model = ScreenModel(20, 2)
+    >>> _ = model.feed(b"12:00:00 ok"); _ = model.flush()
+    >>> _ = model.feed(b"\\x1b[H\\x1b[2J12:00:01 ok")
+    >>> model.flush()
+    b'\\x1b[1;8H1\\x1b[1;12H\\x1b[?25h'
+    """
+
+    def __init__(self, columns=80, lines=24, interval=0.1):
+        if pyte is None:
+            raise RuntimeError("The screen mode needs the pyte package.")
+        self.screen = pyte.Screen(columns, lines)
+        self.stream = pyte.ByteStream(self.screen)
+        self.interval = interval
+        self.last_flush = 0
+        self.echo = False
+        self.cursor = None
+        # the cells of every row as the client has them, (data, sgr)
+        self.shown = {}
+
+    def __len__(self):
+        return len(self.screen.dirty)
+
+    def resize(self, lines, columns):
+        self.screen.resize(lines, columns)
+        self.screen.dirty.update(range(lines))
+        # what the client keeps of its screen on a resize is up to it
+        self.shown.clear()
+
+    def mark_input(self):
+        self.echo = True
+
+    def feed(self, data, now=None):
+        self.stream.feed(bytes(data))
+        return self.due(now)
+
+    def _pending(self):
+        cursor = self.screen.cursor
+        return bool(self.screen.dirty) or self.cursor != (cursor.x, cursor.y, cursor.hidden)
+
+    def due(self, now=None):
+        if not self._pending():
+            return False
+        if self.echo:
+            return True
+        now = time.monotonic() if now is None else now
+        return now - self.last_flush >= self.interval
+
+    def timeout(self, now=None):
+        if not self._pending():
+            return None
+        if self.echo:
+            return 0
+        now = time.monotonic() if now is None else now
+        return max(0, self.last_flush + self.interval - now)
+
+    def flush(self, now=None):
+        """Return the changed rows and the cursor as one escape sequence."""
+        rows = sorted(self.screen.dirty)
+        self.screen.dirty.clear()
+        self.last_flush = time.monotonic() if now is None else now
+        self.echo = False
+        return self._render(rows)
+
+    def snapshot(self):
+        """Return the whole screen, to draw it on a freshly attached client."""
+        self.screen.dirty.clear()
+        self.shown.clear()
+        return _PLAIN.encode() + self._render(range(self.screen.lines))
+
+    def _render(self, rows):
+        screen = self.screen
+        out = []
+        last = _PLAIN
+        for y in rows:
+            line = screen.buffer[y]
+            cells = [(line[x].data, _sgr(line[x])) for x in range(screen.columns)]
+            shown = self.shown.get(y)
+            self.shown[y] = cells
+            # blank cells at the end of the row are erased instead of drawn
+            end = len(cells)
+            while end and cells[end - 1] == _BLANK:
+                end -= 1
+            if shown is None:
+                changed = range(end)
+                erase = True
+            else:
+                changed = [x for x in range(end) if cells[x] != shown[x]]
+                erase = any(cell != _BLANK for cell in shown[end:])
+            runs = []
+            for x in changed:
+                if runs and x - runs[-1][1] <= _GAP:
+                    runs[-1][1] = x + 1
+                else:
+                    runs.append([x, x + 1])
+            for start, stop in runs:
+                out.append("\x1b[%d;%dH" % (y + 1, start + 1))
+                for data, sgr in cells[start:stop]:
+                    if sgr != last:
+                        out.append(sgr)
+                        last = sgr
+                    out.append(data)
+            if erase:
+                if last != _PLAIN:
+                    out.append(_PLAIN)
+                    last = _PLAIN
+                if not runs or runs[-1][1] != end:
+                    out.append("\x1b[%d;%dH" % (y + 1, end + 1))
+                out.append("\x1b[K")
+        if last != _PLAIN:
+            out.append(_PLAIN)
+        cursor = screen.cursor
+        out.append("\x1b[%d;%dH" % (cursor.y + 1, cursor.x + 1))
+        out.append("\x1b[?25l" if cursor.hidden else "\x1b[?25h")
+        self.cursor = (cursor.x, cursor.y, cursor.hidden)
+        return "".join(out).encode()
@@ -0,0 +1,110 @@
+"""
+Runs ObjectScript commands through an IRISSession without a user, for
+``iterm -e``, ``iterm -f`` and piped stdin.
+"""
+import re
+import select
+import time
+from collections import namedtuple
+
+from .irissession import PromptScanner
+
+# an ObjectScript error at the start of a line, <UNDEFINED> *x
+ERROR = rb"(?m)^<[A-Z]+>.*$"
+
+
+class CommandResult(namedtuple("CommandResult", "number command error seconds")):
+    """Outcome of one command, *error* is the first error line or None."""
+
+    @property
+    def status(self):
+        return 0 if self.error is None else 1
+
+
+class ScriptRunner(object):
+    """Feeds commands to *session* one prompt at a time.
+
+    Commands are taken lazily from any iterable of lines, so a script is
+    never read into memory as a whole; their output goes to the binary
+    stream *output* as it arrives, straight from the read buffer, and is
+    flushed once the pty has nothing more ready. A command that prints no prompt within
+    *timeout* seconds, None to wait forever, fails the script, and so does
+    running past the monotonic *deadline*.
+    """
+
+    def __init__(self, session, output=None, error=ERROR, timeout=None, deadline=None):
+        self.session = session
+        self.output = output
+        self.error = re.compile(error.encode() if isinstance(error, str) else error)
+        self.timeout = timeout
+        self.deadline = deadline
+
+    def run(self, lines, stop_on_error=True):
+        """Yield a :class:`CommandResult` for every non-empty line."""
+        number = 0
+        for line in lines:
+            command = line.rstrip("\r\n")
+            if not command.strip():
+                continue
+            number += 1
+            result = self.execute(number, command)
+            yield result
+            if result.error is not None and stop_on_error:
+                break
+
+    def execute(self, number, command):
+        session = self.session
+        start = time.monotonic()
+        session.input.put(command + "\n")
+        scanner = PromptScanner(session.prompt, session.prompt_tail)
+        error = None
+        # the last partial line of output, an error may span two reads
+        line = b""
+        # the prompt is cut from the output, its line break is put back
+        newline = True
+        while True:
+            timeout = self.timeout
+            if self.deadline is not None:
+                left = max(0, self.deadline - time.monotonic())
+                timeout = left if timeout is None else min(timeout, left)
+            wlist = [session.fd] if session.input else []
+            (readable, writable, _) = select.select([session.fd], wlist, [], timeout)
+            if not readable and not writable:
+                error = "<TIMEOUT> no prompt after %.3g seconds" % (
+                    time.monotonic() - start
+                )
+                break
+            if writable:
+                session.input.write()
+            if not readable:
+                continue
+            try:
+                output = session.read_bytes()
+            except OSError:
+                # session ended
+                output = b""
+            if not output:
+                if error is None:
+                    error = "<EOF> session ended"
+                    if session.exited(1):
+                        error += " with status %s" % session.returncode
+                break
+            output, prompt = scanner.feed(output)
+            if error is None:
+                match = self.error.search(line + output[:256]) or self.error.search(output)
+                if match:
+                    error = match.group().strip().decode(errors="replace")
+            line = (line + output[-256:]).rpartition(b"\n")[2]
+            if self.output is not None and output:
+                self.output.write(output)
+                newline = output[-1:] == b"\n"
+                if session.reader.drained:
+                    self.output.flush()
+            if prompt is not None:
+                session.prompted = prompt.decode(errors="replace")
+                break
+        if self.output is not None:
+            if not newline:
+                self.output.write(b"\n")
+            self.output.flush()
+        return CommandResult(number, command, error, time.monotonic() - start)
@@ -0,0 +1,289 @@
+"""
+Pre-started terminal sessions, so a connecting client does not wait for the
+session to boot.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from .irissession import IRISSession
+
+_logger = logging.getLogger(__name__)
+
+
+def _spawn_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, name="session_pool")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def irisdb_starter(cmd):
+    """Return a pool *start* function which boots ``irisdb`` in a namespace
+    and clears its screen, the user specific login is left to the caller."""
+
+    def start(namespace):
+        session = IRISSession.start(cmd + ["-U", namespace] if namespace else cmd)
+        session.drain()
+        session.write(":clear\n")
+        session.drain()
+        return session
+
+    return start
+
+
+class RestartPolicy(object):
+    """Whether a session whose child exited is replaced by a new one.
+
+    *policy* is ``"never"``, ``"on-failure"`` for a non-zero exit status, or
+    ``"always"``. At most *max_restarts* restarts are allowed within *window*
+    seconds, so a session that dies as it starts does not loop.
+
+    >>> policy = RestartPolicy("on-failure", max_restarts=1)
+    >>> policy.restart(0, now=0), policy.restart(1, now=1), policy.restart(1, now=2)
+    (False, True, False)
+    >>> policy.restart(1, now=100)
+    True
+    """
+
+    POLICIES = ("never", "on-failure", "always")
+
+    def __init__(self, policy="never", max_restarts=3, window=60):
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown restart policy %r." % policy)
+        self.policy = policy
+        self.max_restarts = max_restarts
+        self.window = window
+        self.restarts = deque()
+
+    def restart(self, returncode, now=None):
+        """Return True if a session that ended with *returncode* is to be
+        restarted, and count the restart."""
+        if self.policy == "never" or (self.policy == "on-failure" and returncode == 0):
+            return False
+        now = time.monotonic() if now is None else now
+        while self.restarts and now - self.restarts[0] > self.window:
+            self.restarts.popleft()
+        if len(self.restarts) >= self.max_restarts:
+            _logger.warning("Session restarted too often, giving up.")
+            return False
+        self.restarts.append(now)
+        return True
+
+
+class SessionPool(object):
+    """Keeps up to *size* idle sessions per namespace.
+
+    *start* is called with a namespace and returns a ready session, which must
+    have ``alive()``, ``close()`` and a ``started`` monotonic timestamp.
+    Sessions idle for more than *max_age* seconds are closed instead of being
+    handed out, and by a reaper every *reap_interval* seconds while there are
+    idle sessions, so a pool no longer used does not keep its processes.
+    *spawn* runs the background refill and the reaper, it defaults to a daemon
+    thread, and the reaper waits with *sleep*, ``time.sleep`` by default; pass
+    ``sio.start_background_task`` and ``sio.sleep`` under eventlet, where
+    ``time.sleep`` would block the hub.
+    """
+
+    def __init__(
+        self, start, size=1, max_age=300, spawn=None, reap_interval=30, sleep=None
+    ):
+        self.start = start
+        self.size = size
+        self.max_age = max_age
+        self.spawn = spawn or _spawn_thread
+        self.sleep = sleep or time.sleep
+        self.reap_interval = min(reap_interval, max_age)
+        self.idle = {}
+        self.filling = set()
+        self.reaping = False
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "started": 0,
+            "expired": 0,
+            "start_seconds": 0.0,
+            "first_prompt_count": 0,
+            "first_prompt_seconds": 0.0,
+            "first_prompt_max": 0.0,
+        }
+
+    def acquire(self, namespace=None):
+        """Hand out an idle session, or start one if none is ready."""
+        session = self._pop(namespace)
+        with self.lock:
+            self.stats["hits" if session else "misses"] += 1
+        if not session:
+            session = self._start(namespace)
+        self.fill(namespace)
+        return session
+
+    def fill(self, namespace=None):
+        """Top up the idle sessions for *namespace* in the background."""
+        if self.size <= 0:
+            return
+        with self.lock:
+            if namespace in self.filling:
+                return
+            self.filling.add(namespace)
+        self.spawn(self._fill, namespace)
+
+    def record_first_prompt(self, seconds):
+        """Record the time a client waited from connect to its first output."""
+        with self.lock:
+            stats = self.stats
+            stats["first_prompt_count"] += 1
+            stats["first_prompt_seconds"] += seconds
+            stats["first_prompt_max"] = max(stats["first_prompt_max"], seconds)
+        _logger.info("Time to first prompt %.3fs.", seconds)
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["idle"] = {ns: len(sessions) for ns, sessions in self.idle.items()}
+        if stats["started"]:
+            stats["start_avg"] = stats["start_seconds"] / stats["started"]
+        if stats["first_prompt_count"]:
+            stats["first_prompt_avg"] = (
+                stats["first_prompt_seconds"] / stats["first_prompt_count"]
+            )
+        return stats
+
+    def reap(self):
+        """Close the idle sessions that have expired, return how many.
+
+        >>> class Session(object):
+        ...     started = time.monotonic()
+        ...     def alive(self):
+        ...         return True
+        ...     def close(self):
+        ...         pass
+        >>> pool = SessionPool(lambda namespace: Session(), max_age=5, spawn=lambda *a: None)
+        >>> pool._fill("USER")
+        >>> pool.reap()
+        0
+        >>> Session.started -= 10
+        >>> pool.reap(), pool.metrics()["idle"], pool.stats["expired"]
+        (1, {'USER': 0}, 1)
+
+        The reaper runs this every *reap_interval*, waiting with *sleep*.
+
+        >>> def sleep(seconds):
+        ...     print("sleep", seconds)
+        ...     Session.started -= 10
+        >>> tasks = []
+        >>> Session.started = time.monotonic()
+        >>> pool = SessionPool(lambda namespace: Session(), max_age=5,
+        ...                    spawn=lambda *task: tasks.append(task), sleep=sleep)
+        >>> pool._fill("USER")
+        >>> reaper, = tasks
+        >>> reaper[0]()
+        sleep 5
+        >>> pool.stats["expired"], pool.reaping
+        (1, False)
+        """
+        expired = []
+        with self.lock:
+            for sessions in self.idle.values():
+                for session in [s for s in sessions if self._expired(s)]:
+                    sessions.remove(session)
+                    expired.append(session)
+            self.stats["expired"] += len(expired)
+        for session in expired:
+            session.close()
+        return len(expired)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for sessions in idle.values():
+            for session in sessions:
+                session.close()
+
+    def _expired(self, session):
+        return (
+            not session.alive()
+            or time.monotonic() - session.started > self.max_age
+        )
+
+    def _pop(self, namespace):
+        while True:
+            with self.lock:
+                sessions = self.idle.get(namespace)
+                if not sessions:
+                    return None
+                session = sessions.popleft()
+            if not self._expired(session):
+                return session
+            with self.lock:
+                self.stats["expired"] += 1
+            session.close()
+
+    def _start(self, namespace):
+        start = time.monotonic()
+        session = self.start(namespace)
+        with self.lock:
+            self.stats["started"] += 1
+            self.stats["start_seconds"] += time.monotonic() - start
+        return session
+
+    def _fill(self, namespace):
+        try:
+            while True:
+                with self.lock:
+                    sessions = self.idle.setdefault(namespace, deque())
+                    expired = [s for s in sessions if self._expired(s)]
+                    for session in expired:
+                        sessions.remove(session)
+                    missing = self.size - len(sessions)
+                    self.stats["expired"] += len(expired)
+                for session in expired:
+                    session.close()
+                if missing <= 0:
+                    break
+                session = self._start(namespace)
+                with self.lock:
+                    self.idle.setdefault(namespace, deque()).append(session)
+                self._start_reaper()
+        except Exception:
+            _logger.exception("Unable to start a session for the pool.")
+        finally:
+            with self.lock:
+                self.filling.discard(namespace)
+
+    def _start_reaper(self):
+        with self.lock:
+            if self.reaping:
+                return
+            self.reaping = True
+        self.spawn(self._reap)
+
+    def _reap(self):
+        # runs while there are idle sessions, a new one starts it again
+        try:
+            while True:
+                self.sleep(self.reap_interval)
+                self.reap()
+                with self.lock:
+                    if not any(self.idle.values()):
+                        self.reaping = False
+                        return
+        except Exception:
+            _logger.exception("Unable to reap the idle sessions.")
+            with self.lock:
+                self.reaping = False
+
+
+_shared = {}
+
+
+def shared(name, start, **kwargs):
+    """Return the process wide pool *name*, created with *start* and *kwargs*
+    on first use. Lets code that runs once per connection, like the
+    ``iTerm.Engine`` websocket, reuse the pool of its process."""
+    pool = _shared.get(name)
+    if pool is None:
+        pool = _shared[name] = SessionPool(start, **kwargs)
+    return pool
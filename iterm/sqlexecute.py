@@ -1,15 +1,32 @@
 import logging
+import time
 import intersystems_iris.dbapi._DBAPI as dbapi
 import sqlparse
 import traceback
 
+from . import connpool
 from .packages import special
-from .utils import parse_uri
+from .resultset import ResultRows
+from .statementcache import StatementCache
+from .utils import has_meta_cmd, parse_uri
 
 _logger = logging.getLogger(__name__)
 
 
 class SQLExecute:
+    # rows fetched from the server at a time, a result is never read whole
+    arraysize = 1000
+    # statements whose cursors are kept, so running them again skips the
+    # prepare on the server
+    statement_cache_size = 32
+    # connections shared by every SQLExecute on the same server and user
+    pool_min_size = 1
+    pool_max_size = 4
+    # seconds a cancel waits for a side connection from the pool
+    cancel_timeout = 5
+    # ends the server job, by its number, running a statement to cancel
+    cancel_query = "SELECT %SYSTEM.Process_Terminate(?)"
+
     schemas_query = """
         SELECT 
             SCHEMA_NAME
@@ -91,9 +108,22 @@ class SQLExecute:
         conn_params["embedded"] = self.embedded
         conn_params.update(self.extra_params)
 
-        conn = dbapi.connect(**conn_params)
+        self.pool = connpool.shared(
+            conn_params,
+            lambda: dbapi.connect(**conn_params),
+            min_size=self.pool_min_size,
+            max_size=self.pool_max_size,
+        )
+        special.set_connection_pool(self.pool)
+        self._attach(self.pool.acquire())
+
+    def _attach(self, conn):
         self.conn = conn
         self.conn.setAutoCommit(True)
+        self.statements = StatementCache(conn, self.statement_cache_size)
+        self.last_used = time.monotonic()
+        # the server process of the connection, which a cancel ends
+        self.server_job = None
         if self.embedded:
             self.server_version = self.conn.iris.system.Version.GetVersion()
             self.username = self.conn.iris.system.Process.UserName()
@@ -101,11 +131,86 @@ class SQLExecute:
             self.hostname = self.conn.iris.system.Util.InstallDirectory()
         else:
             self.server_version = self.conn._connection_info._server_version
+            self.server_job = getattr(
+                self.conn._connection_info, "_server_job_number", None
+            )
+
+    def close(self):
+        """Hand the connection back to the pool."""
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        try:
+            self.statements.clear()
+        except Exception as e:
+            # a cursor that does not close leaves the connection in doubt
+            _logger.error("Closing cached statements failed: %r", e)
+            self.pool.discard(conn)
+            return
+        self.pool.release(conn)
+
+    def reconnect(self):
+        """Replace a dead connection with a new one from the pool."""
+        self.pool.discard(self.conn)
+        try:
+            self.statements.clear()
+        except Exception:
+            # the cursors went with the connection
+            pass
+        self._attach(self.pool.acquire())
+
+    def cancel(self):
+        """Stop the statement running on the connection, called from
+        another thread than the one running it.
+
+        The server job of the connection is ended with ``cancel_query`` over
+        a side connection from the pool; if there is none, or the connection
+        is embedded, the connection is closed under the statement instead.
+        Either way the connection is gone, :meth:`reconnect` replaces it.
+        """
+        conn, job = self.conn, self.server_job
+        if conn is None:
+            return
+        if job is not None:
+            try:
+                side = self.pool.acquire(timeout=self.cancel_timeout)
+            except Exception as e:
+                _logger.error("No connection to cancel on: %r", e)
+            else:
+                try:
+                    with side.cursor() as cur:
+                        _logger.debug(
+                            "Cancelling job %s. sql: %r", job, self.cancel_query
+                        )
+                        cur.execute(self.cancel_query, (job,))
+                    self.pool.release(side)
+                    return
+                except Exception as e:
+                    _logger.error("Cancel of job %s failed: %r", job, e)
+                    self.pool.discard(side)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def check_connection(self):
+        """Reconnect if the connection has been idle long enough to have been
+        dropped, and is found dead."""
+        if self.conn is None:
+            self._attach(self.pool.acquire())
+        idle = time.monotonic() - self.last_used
+        if idle > self.pool.check_after and not self.pool.alive(self.conn):
+            _logger.info("Connection lost after %.0fs idle, reconnecting.", idle)
+            self.reconnect()
+        self.last_used = time.monotonic()
 
     def run(
         self,
         statement,
+        params=None,
     ):
+        """Run every statement in *statement*, *params* are bound to the ``?``
+        placeholders of each one."""
         statement = statement.strip()
         if not statement:  # Empty string
             yield None, None, None, None, statement, False, False
@@ -129,6 +234,8 @@ class SQLExecute:
         else:
             sqlarr = sqlparse.split(statement)
 
+        self.check_connection()
+
         # run each sql query
         for sql in sqlarr:
             # Remove spaces, eol and semi-colons.
@@ -138,16 +245,10 @@ class SQLExecute:
                 continue
 
             try:
-                try:
-                    cur = self.conn.cursor()
-                except dbapi.InterfaceError:
-                    cur = None
-                try:
-                    _logger.debug("Trying a dbspecial command. sql: %r", sql)
-                    for result in special.execute(cur, sql):
-                        yield result + (sql, True, True)
-                except special.CommandNotFound:
-                    yield self.execute_normal_sql(sql) + (sql, True, False)
+                if special.is_command(sql):
+                    yield from self._run_special(sql)
+                else:
+                    yield self.execute_normal_sql(sql, params) + (sql, True, False)
 
             except dbapi.OperationalError as e:
                 _logger.error("sql: %r, error: %r", sql, e)
@@ -155,31 +256,61 @@ class SQLExecute:
 
                 yield None, None, None, e, sql, False, False
 
-    def execute_normal_sql(self, split_sql):
-        """Returns tuple (title, rows, headers, status)"""
+    def _run_special(self, sql):
+        # a cursor of its own, closed once its results have been read
+        try:
+            cur = self.conn.cursor()
+        except dbapi.InterfaceError:
+            cur = None
+        try:
+            _logger.debug("Trying a dbspecial command. sql: %r", sql)
+            for result in special.execute(cur, sql):
+                yield result + (sql, True, True)
+        finally:
+            if cur is not None:
+                cur.close()
+
+    def execute_normal_sql(self, split_sql, params=None):
+        """Returns tuple (title, rows, headers, status)
+
+        The rows of a query are a :class:`ResultRows`, fetched as they are
+        read; its status gives the row count once they have all been read.
+        The statement runs on its cached cursor, see :class:`StatementCache`;
+        one that changes the schema drops them all.
+        """
         _logger.debug("Regular sql statement. sql: %r", split_sql)
 
         title = headers = None
 
-        cursor = self.conn.cursor()
-        cursor.execute(split_sql)
+        statements = self.statements
+        if has_meta_cmd(split_sql):
+            cursor, sql = self.conn.cursor(), split_sql
+            statements.clear()
+        else:
+            cursor, sql = statements.acquire(split_sql)
+        try:
+            cursor.execute(sql, params or ())
+        except Exception:
+            statements.discard(cursor, sql)
+            raise
 
         # cur.description will be None for operations that do not return
         # rows.
         if cursor.description:
             headers = [x[0] for x in cursor.description]
-            status = "{0} row{1} in set"
-            cursor = list(cursor)
-            rowcount = len(cursor)
-        else:
-            _logger.debug("No rows in result.")
-            status = "Query OK, {0} row{1} affected"
-            rowcount = 0 if cursor.rowcount == -1 else cursor.rowcount
-            cursor = None
+            rows = ResultRows(
+                cursor, self.arraysize, lambda cursor: statements.release(cursor, sql)
+            )
+            return (title, rows, headers, rows.status)
 
-        status = status.format(rowcount, "" if rowcount == 1 else "s")
+        _logger.debug("No rows in result.")
+        rowcount = 0 if cursor.rowcount == -1 else cursor.rowcount
+        statements.release(cursor, sql)
+        status = "Query OK, {0} row{1} affected".format(
+            rowcount, "" if rowcount == 1 else "s"
+        )
 
-        return (title, cursor, headers, status)
+        return (title, None, headers, status)
 
     def schemas(self):
         """Yields schema names"""
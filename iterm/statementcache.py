@@ -0,0 +1,128 @@
+"""
+Cursors of recently run statements, kept so a statement run again is not
+prepared again on the server.
+"""
+import re
+from collections import OrderedDict
+
+# a quoted literal, kept as it is, or a run of whitespace and comments
+_WHITESPACE = re.compile(
+    r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(?:\s|--[^\n]*|/\*.*?\*/)+", re.S
+)
+
+
+def normalize(sql):
+    """Return *sql* with comments dropped and whitespace collapsed outside
+    of literals, the key of its cursor. It is only a key, the statement is
+    run as it was given.
+
+    >>> normalize("SELECT  *\\n  FROM t WHERE name = 'a  b' ;")
+    "SELECT * FROM t WHERE name = 'a  b'"
+    >>> normalize("SELECT a -- note\\nFROM t")
+    'SELECT a FROM t'
+    >>> normalize("SELECT 'x\\n  -- y' /* z */ FROM t")
+    "SELECT 'x\\n  -- y' FROM t"
+    """
+    sql = _WHITESPACE.sub(lambda m: m.group(1) or " ", sql).strip()
+    return sql.rstrip(";").rstrip()
+
+
+class StatementCache(object):
+    """The cursors of the last *size* statements run on *conn*, by
+    normalized SQL text.
+
+    PEP 249 lets a cursor skip preparing an operation again when the same
+    operation object is executed on it, so every statement is run on its own
+    cursor with the text it was first run with, as long as it is given the
+    same text again; parameters are bound with ``?``. Text that differs only
+    in whitespace or comments gets the same cursor and runs as given. A
+    cursor whose result is still being read is busy, the same statement
+    meanwhile runs on a fresh cursor.
+
+    >>> import sqlite3
+    >>> cache = StatementCache(sqlite3.connect(":memory:"), size=2)
+    >>> cursor, sql = cache.acquire("SELECT ?")
+    >>> cursor.execute(sql, (1,)).fetchall()
+    [(1,)]
+    >>> cache.release(cursor, sql)
+    >>> cache.acquire("SELECT  ?")[0] is cursor
+    True
+    >>> cache.stats["hits"], cache.stats["misses"]
+    (1, 1)
+
+    A comment or a literal spanning lines runs as it was written:
+
+    >>> cursor, sql = cache.acquire("SELECT 'a\\n  b' -- note\\n, 2")
+    >>> cursor.execute(sql).fetchall()
+    [('a\\n  b', 2)]
+    """
+
+    def __init__(self, conn, size=32):
+        self.conn = conn
+        self.size = size
+        # normalized SQL -> (its cursor, the SQL object first executed on it)
+        self.entries = OrderedDict()
+        self.busy = set()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def acquire(self, sql):
+        """Return a cursor for *sql* and the text to execute on it, which
+        equals *sql*; hand the cursor back with :meth:`release` once its
+        result has been read."""
+        key = normalize(sql)
+        entry = self.entries.get(key)
+        if entry is not None and key not in self.busy:
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            if entry is not None or self.size <= 0:
+                # a result of this statement is still being read
+                return self.conn.cursor(), sql
+            entry = self.entries[key] = (self.conn.cursor(), sql)
+            self._evict()
+        self.busy.add(key)
+        cursor, cached = entry
+        # the cached object skips the prepare, other text is prepared anew
+        return cursor, cached if cached == sql else sql
+
+    def release(self, cursor, sql):
+        """The result of *cursor* has been read, it can run *sql* again."""
+        key = normalize(sql)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is cursor:
+            self.busy.discard(key)
+        else:
+            # not cached, or evicted while it was busy
+            cursor.close()
+
+    def discard(self, cursor, sql):
+        """Drop the cursor of *sql*, after an error left it in doubt."""
+        key = normalize(sql)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is cursor:
+            del self.entries[key]
+            self.busy.discard(key)
+        cursor.close()
+
+    def clear(self):
+        """Drop all cursors, after a statement that changed the schema."""
+        for key, (cursor, _) in self.entries.items():
+            if key not in self.busy:
+                cursor.close()
+        self.entries.clear()
+        self.busy.clear()
+        self.stats["invalidations"] += 1
+
+    def _evict(self):
+        while len(self.entries) > self.size:
+            key, (cursor, _) = self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+            if key in self.busy:
+                # closed on release
+                self.busy.discard(key)
+            else:
+                cursor.close()
@@ -12,4 +12,17 @@ def parse_uri(uri, hostname=None, port=None, namespace=None, username=None):
         port = parsed.port or port
     if parsed.scheme == "iris+emb":
         embedded = True
-    return hostname, port, namespace, username, password, embedded
\ No newline at end of file
+    return hostname, port, namespace, username, password, embedded
+
+
+def has_meta_cmd(query):
+    """Determines if the completion needs a refresh by checking if the sql
+    statement is an alter, create, drop, commit or rollback."""
+    try:
+        first_token = query.split()[0]
+        if first_token.lower() in ("alter", "create", "drop", "commit", "rollback"):
+            return True
+    except Exception:
+        return False
+
+    return False
@@ -0,0 +1,141 @@
+import time
+
+from iterm.metrics import SessionMetrics
+from iterm.relay import text_decoder
+
+
+class TerminalSession(object):
+    """A browser terminal attached to an IRISSession.
+
+    The session outlives its socket.io connection: a client that reconnects
+    with the session token is attached again and gets the output it missed
+    from the scrollback ring.
+    """
+
+    def __init__(self, token, pty, coalescer, scrollback, screen=None, policy=None):
+        self.token = token
+        self.pty = pty
+        # restarts the child when it exits by itself, None never does
+        self.policy = policy
+        # set once the terminal is being shut down, its child is not restarted
+        self.killed = False
+        # in screen mode the screen model takes the output instead, and the
+        # client gets the cells that changed
+        self.screen = screen
+        self.coalescer = coalescer if screen is None else screen
+        self.scrollback = scrollback
+        self.connected = time.monotonic()
+        self.sid = None
+        # monotonic time of the last disconnect, None while attached
+        self.detached = None
+        self.binary = False
+        self.flow = None
+        self.resumed = None
+        self.decoder = text_decoder()
+        # the pty a writer is draining the input queue into, None while no
+        # writer runs; a writer left over from a replaced pty does not count
+        self.writing = None
+        # the token resumes the session, so metrics go by the child pid
+        self.metrics = SessionMetrics(str(pty.pid), pty.input)
+
+    @property
+    def fd(self):
+        return self.pty.fd
+
+    @property
+    def exit_fd(self):
+        return self.pty.exit_fd
+
+    def attach(self, sid, binary=False, flow=None, resumed=None):
+        self.sid = sid
+        self.detached = None
+        # raw pty bytes are sent as binary frames, when the client asked for it
+        self.binary = binary
+        # set when the client acknowledges consumed output, None otherwise
+        self.flow = flow
+        self.resumed = resumed
+        self.decoder = text_decoder()
+
+    def detach(self):
+        self.sid = None
+        self.detached = time.monotonic()
+        self._wake_reader()
+
+    def resize(self, rows, cols):
+        self.pty.resize(rows, cols)
+        if self.screen is not None:
+            self.screen.resize(rows, cols)
+
+    def write(self, input: str):
+        """Queue client input, returns True if a writer has to be started."""
+        if self.fd is None:
+            return False
+        self.coalescer.mark_input()
+        self.metrics.received(len(input))
+        self.pty.input.put(input)
+        if self.writing is self.pty:
+            # the running writer sends it along with the earlier input
+            return False
+        self.writing = self.pty
+        return True
+
+    @property
+    def input_depth(self):
+        """Bytes of client input not yet written to the pty."""
+        return len(self.pty.input)
+
+    def sent(self, size):
+        if self.flow:
+            self.flow.sent(size)
+
+    def acked(self, size):
+        if self.flow and self.flow.acked(size):
+            self.resumed.set()
+
+    def wait_resumed(self, timeout=1):
+        """Block the reader while the client is behind on output, looking
+        every *timeout* seconds whether the child is still there."""
+        while self.flow and self.flow.paused and self.pty.alive():
+            self.resumed.clear()
+            self.resumed.wait(timeout)
+
+    def kill(self):
+        """Stop the child, its reader sees it exit and calls close()."""
+        self.killed = True
+        if self.pty.running():
+            self.pty.proc.kill()
+        self._wake_reader()
+
+    def close(self):
+        """Reap the child and release the pty, returns the exit status."""
+        self.pty.close()
+        return self.pty.returncode
+
+    def restart(self, returncode):
+        """Return True if the exited child is to be replaced."""
+        return (
+            not self.killed
+            and self.policy is not None
+            and self.policy.restart(returncode)
+        )
+
+    def replace(self, pty):
+        """Attach a new child, keeping the token, scrollback and client."""
+        self.pty = pty
+        self.writing = None
+        self.metrics = SessionMetrics(str(pty.pid), pty.input)
+
+    def _wake_reader(self):
+        # a reader paused for the client has to notice the change
+        flow, resumed = self.flow, self.resumed
+        self.flow = self.resumed = None
+        if resumed is not None:
+            flow.paused = False
+            resumed.set()
+
+
+# attached terminals by socket.io sid
+sessions = {}
+
+# all live terminals, attached or not, by session token
+tokens = {}
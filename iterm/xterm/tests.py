@@ -1,3 +1,84 @@
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from iterm.relay import InputQueue, OutputCoalescer, ScrollbackRing
+from . import views
+from .sessions import TerminalSession, sessions, tokens
+
+
+class ReconnectTest(TestCase):
+    def setUp(self):
+        sessions.clear()
+        tokens.clear()
+        patches = [
+            mock.patch.object(views, "sio"),
+            mock.patch.object(views, "pool"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        views.pool.acquire.side_effect = lambda: mock.Mock(
+            pid=1, fd=10, exit_fd=None, input=InputQueue(10)
+        )
+
+    def test_reconnect_before_disconnect(self):
+        views.connect("old", {}, {})
+        session = sessions["old"]
+
+        # the client reconnects with its token, the server has not seen the
+        # old socket drop yet
+        views.connect("new", {}, {"token": session.token})
+
+        self.assertIs(sessions["new"], session)
+        self.assertNotIn("old", sessions)
+        self.assertEqual(session.sid, "new")
+        self.assertEqual(views.pool.acquire.call_count, 1)
+        views.sio.disconnect.assert_called_with("old")
+
+        # the late disconnect of the old socket leaves the session attached
+        views.disconnect("old")
+        self.assertEqual(session.sid, "new")
+        self.assertIsNone(session.detached)
+
+    def test_reconnect_after_disconnect(self):
+        views.connect("old", {}, {})
+        session = sessions["old"]
+        views.disconnect("old")
+
+        views.connect("new", {}, {"token": session.token})
+
+        self.assertIs(sessions["new"], session)
+        self.assertEqual(views.pool.acquire.call_count, 1)
+
+
+class WriterTest(TestCase):
+    def setUp(self):
+        sessions.clear()
+        tokens.clear()
+        patch = mock.patch.object(views, "sio")
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def pty(self, fd):
+        return mock.Mock(pid=fd, fd=fd, exit_fd=None, input=InputQueue(fd))
+
+    def test_writer_of_a_replaced_pty(self):
+        old, new = self.pty(10), self.pty(11)
+        session = TerminalSession("token", old, OutputCoalescer(), ScrollbackRing())
+        self.assertTrue(session.write("a"))
+
+        def restart(rlist, wlist, xlist, timeout):
+            # the child exits while the old writer waits, and the new pty
+            # gets input of its own
+            old.fd = None
+            session.replace(new)
+            self.assertTrue(session.write("b"))
+            return [], [], []
+
+        with mock.patch.object(views.green_select, "select", side_effect=restart):
+            views.write_pty_input(session)
+
+        # the old writer left the new one alone, there is still one writer
+        self.assertIs(session.writing, new)
+        self.assertFalse(session.write("c"))
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path("", views.index, name="index"),
+    path("metrics", views.metrics, name="metrics"),
+    path("metrics.json", views.metrics_json, name="metrics_json"),
+]
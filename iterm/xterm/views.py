@@ -1,60 +1,201 @@
-import os
+import time
+import uuid
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 import socketio
-import pty
-import select
-import subprocess
-import struct
-import fcntl
-import termios
-import signal
 import eventlet
+from eventlet.green import select as green_select
+
+from iterm.irissession import IRISSession
+from iterm.metrics import Registry, prometheus
+from iterm.relay import FlowControl, OutputCoalescer, PtyReader, ScrollbackRing
+from iterm.screen import ScreenModel
+from iterm.sessionpool import RestartPolicy, SessionPool
+from .sessions import TerminalSession, sessions, tokens
 
 
 async_mode = "eventlet"
 sio = socketio.Server(async_mode=async_mode)
 
-# will be used as global variables
-fd = None
-child_pid = None
+# command started in a new pty for every terminal
+COMMAND = getattr(
+    settings, "ITERM_COMMAND", ["docker", "exec", "-it", "iris", "iris", "session", "iris"]
+)
+
+# pty output is sent once this many bytes are buffered, or once the oldest
+# buffered byte is this many seconds old
+COALESCE_BYTES = getattr(settings, "ITERM_COALESCE_BYTES", 16384)
+COALESCE_DELAY = getattr(settings, "ITERM_COALESCE_DELAY", 0.008)
+
+# clients acknowledging output stop the pty reads with more than FLOW_HIGH
+# bytes in flight, until they are down to FLOW_LOW
+FLOW_HIGH = getattr(settings, "ITERM_FLOW_HIGH", 256 * 1024)
+FLOW_LOW = getattr(settings, "ITERM_FLOW_LOW", 64 * 1024)
+
+# the last output of every terminal kept for clients that reconnect, and how
+# long a terminal waits for its client to come back
+SCROLLBACK_BYTES = getattr(settings, "ITERM_SCROLLBACK_BYTES", 64 * 1024)
+DETACH_TIMEOUT = getattr(settings, "ITERM_DETACH_TIMEOUT", 60)
+
+# clients in screen mode get the changed cells at most this often, in seconds
+SCREEN_INTERVAL = getattr(settings, "ITERM_SCREEN_INTERVAL", 0.1)
+
+# terminals started ahead of time, so a client attaches without waiting for
+# the boot; their output stays in the pty until the client reads it
+pool = SessionPool(
+    lambda namespace: IRISSession.start(COMMAND),
+    size=getattr(settings, "ITERM_POOL_SIZE", 2),
+    max_age=getattr(settings, "ITERM_POOL_MAX_AGE", 300),
+    spawn=sio.start_background_task,
+    sleep=sio.sleep,
+)
+
+# a terminal whose child exits by itself gets a new one: "never",
+# "on-failure" for a non-zero exit status, or "always"; at most MAX_RESTARTS
+# times a minute
+RESTART_POLICY = getattr(settings, "ITERM_RESTART_POLICY", "never")
+MAX_RESTARTS = getattr(settings, "ITERM_MAX_RESTARTS", 3)
+
+# counters of the terminals served by this process
+registry = Registry()
 
 
 def index(request):
     return render(request, "index.html")
 
 
-# changes the size reported to TTY-aware applications like vim
-def set_winsize(fd, row, col, xpix=0, ypix=0):
-    winsize = struct.pack("HHHH", row, col, xpix, ypix)
-    fcntl.ioctl(fd, termios.TIOCSWINSZ, winsize)
+def metrics(request):
+    return HttpResponse(
+        prometheus(registry.snapshot()), content_type="text/plain; version=0.0.4"
+    )
+
 
+def metrics_json(request):
+    snapshot = registry.snapshot()
+    snapshot["pool"] = pool.metrics()
+    return JsonResponse(snapshot)
 
-def read_and_forward_pty_output():
-    global fd
-    max_read_bytes = 1024 * 20
+
+def emit_output(session, output):
+    session.sent(len(output))
+    session.metrics.sent(len(output))
+    if session.binary:
+        sio.emit("pty_output", output, to=session.sid)
+    else:
+        message = {"output": session.decoder.decode(output), "bytes": len(output)}
+        sio.emit("pty_output", message, to=session.sid)
+
+
+def forward_pty_output(session):
+    """Relay the output of the session's child until it exits."""
+    reader = PtyReader(session.fd)
+    coalescer = session.coalescer
+    prompted = False
+    exited = False
+    done = False
+    while not done:
+        session.wait_resumed()
+        # block in the eventlet hub until the pty is readable or the child
+        # exits, so an idle terminal costs no wakeups; while output is
+        # buffered, wake up in time to send it before its deadline. Once the
+        # child is gone, only what is left in the pty is read, even if a
+        # grandchild keeps it open
+        watched = [session.fd]
+        if session.exit_fd is not None and not exited:
+            watched.append(session.exit_fd)
+        timeout = 0 if exited else coalescer.timeout()
+        ready = []
+        try:
+            (ready, _, _) = green_select.select(watched, [], [], timeout)
+            data_ready = session.fd in ready
+            output = reader.read() if data_ready else b""
+        except OSError:
+            # child is gone
+            data_ready, output = True, b""
+        exited = exited or session.exit_fd in ready
+        done = (data_ready and not output) or (exited and not data_ready)
+        if output:
+            session.metrics.read(len(output))
+            coalescer.feed(output)
+        if coalescer.due() or (done and len(coalescer)):
+            output = coalescer.flush()
+            # output is kept while the client is away, to be replayed on resume
+            session.scrollback.write(output)
+            if session.sid:
+                emit_output(session, output)
+                if not prompted:
+                    prompted = True
+                    pool.record_first_prompt(time.monotonic() - session.connected)
+
+
+def read_and_forward_pty_output(session):
     while True:
-        sio.sleep(0.01)
-        if fd:
-            timeout_sec = 0
-            (data_ready, _, _) = select.select([fd], [], [], timeout_sec)
-            if data_ready:
-                output = os.read(fd, max_read_bytes).decode()
-                sio.emit("pty_output", {"output": output})
-        else:
-            print("process killed")
-            return
+        forward_pty_output(session)
+        registry.remove(session.metrics)
+        returncode = session.close()
+        restart = session.restart(returncode)
+        if session.sid:
+            sio.emit("pty_exit", {"code": returncode, "restart": restart}, to=session.sid)
+        if not restart:
+            break
+        session.replace(pool.acquire())
+        registry.add(session.metrics)
+
+    tokens.pop(session.token, None)
+    if session.sid and sessions.get(session.sid) is session:
+        del sessions[session.sid]
+        sio.disconnect(session.sid)
+    print("process exited", session.token, returncode)
+
+
+def write_pty_input(session):
+    """Write queued input as the pty accepts it, without blocking the hub.
+
+    The writer stays with the pty it was started for; once a restart has
+    replaced it, the writer of the new pty is not its business.
+    """
+    pty = session.pty
+    queue = pty.input
+    try:
+        while queue and pty.fd is not None:
+            (_, writable, _) = green_select.select([], [pty.fd], [], 1)
+            if writable:
+                queue.write()
+    except OSError:
+        # child is gone
+        pass
+    finally:
+        if session.writing is pty:
+            session.writing = None
+
+
+def expire_detached(session, detached):
+    sio.sleep(DETACH_TIMEOUT)
+    if session.detached == detached:
+        # client did not come back
+        session.kill()
 
 
 @sio.event
 def resize(sid, message):
-    if fd:
-        set_winsize(fd, message["rows"], message["cols"])
+    session = sessions.get(sid)
+    if session:
+        session.resize(message["rows"], message["cols"])
 
 
 @sio.event
 def pty_input(sid, message):
-    if fd:
-        os.write(fd, message["input"].encode())
+    session = sessions.get(sid)
+    if session and session.write(message["input"]):
+        sio.start_background_task(write_pty_input, session)
+
+
+@sio.event
+def pty_ack(sid, message):
+    session = sessions.get(sid)
+    if session:
+        session.acked(message["bytes"])
 
 
 @sio.event
@@ -63,41 +204,64 @@ def disconnect_request(sid):
 
 
 @sio.event
-def connect(sid, environ):
-    global fd
-    global child_pid
-
-    if child_pid:
-        # already started child process, don't start another
-        # write a new line so that when a client refresh the shell prompt is printed
-        os.write(fd, "\n".encode())
-        return
-
-    # create child process attached to a pty we can read from and write to
-    (child_pid, fd) = pty.fork()
+def connect(sid, environ, auth=None):
+    auth = auth or {}
+    flow = resumed = None
+    if auth.get("ack"):
+        flow = FlowControl(FLOW_HIGH, FLOW_LOW)
+        resumed = sio.eio.create_event()
 
-    if child_pid == 0:
-        # this is the child process fork.
-        # anything printed here will show up in the pty, including the output
-        # of this subprocess
-        subprocess.run(["docker", "exec", "-it", "iris", "iris", "session", "iris"])
+    session = tokens.get(auth.get("token"))
+    if session:
+        if session.sid is not None:
+            # the client is back before its old socket was seen to drop, the
+            # new one takes the terminal over
+            stale = session.sid
+            sessions.pop(stale, None)
+            session.detach()
+            sio.disconnect(stale)
+        # a client coming back, send what it missed since its last offset
+        session.attach(sid, bool(auth.get("binary")), flow, resumed)
+        sessions[sid] = session
+        if session.screen is not None:
+            # the screen as it is now replaces whatever the client missed
+            sio.emit("pty_session", {"token": session.token, "offset": 0}, to=sid)
+            emit_output(session, session.screen.snapshot())
+            return
+        offset, output = session.scrollback.since(auth.get("offset", 0))
+        sio.emit("pty_session", {"token": session.token, "offset": offset}, to=sid)
+        if output:
+            emit_output(session, output)
+        return
 
-    else:
-        # this is the parent process fork.
-        sio.start_background_task(target=read_and_forward_pty_output)
+    screen = None
+    if auth.get("screen"):
+        screen = ScreenModel(
+            auth.get("cols", 80), auth.get("rows", 24), interval=SCREEN_INTERVAL
+        )
+    session = TerminalSession(
+        uuid.uuid4().hex,
+        pool.acquire(),
+        OutputCoalescer(COALESCE_BYTES, COALESCE_DELAY),
+        ScrollbackRing(SCROLLBACK_BYTES),
+        screen=screen,
+        policy=RestartPolicy(RESTART_POLICY, MAX_RESTARTS),
+    )
+    if "rows" in auth and "cols" in auth:
+        session.resize(auth["rows"], auth["cols"])
+    session.attach(sid, bool(auth.get("binary")), flow, resumed)
+    sessions[sid] = session
+    tokens[session.token] = session
+    registry.add(session.metrics)
+    sio.emit("pty_session", {"token": session.token, "offset": 0}, to=sid)
+    sio.start_background_task(read_and_forward_pty_output, session)
 
 
 @sio.event
 def disconnect(sid):
-
-    global fd
-    global child_pid
-
-    # kill pty process
-    os.kill(child_pid, signal.SIGKILL)
-    os.wait()
-
-    # reset the variables
-    fd = None
-    child_pid = None
-    print("Client disconnected")
+    session = sessions.pop(sid, None)
+    if session:
+        # keep the terminal running for a while, the client may reconnect
+        session.detach()
+        sio.start_background_task(expire_detached, session, session.detached)
+    print("Client disconnected", sid)
@@ -46,6 +46,10 @@ setup(
     long_description=readme,
     long_description_content_type="text/markdown",
     install_requires=install_requirements,
+    extras_require={
+        "screen": ["pyte >= 0.8"],
+        "export": ["pyarrow >= 10", "zstandard >= 0.19"],
+    },
     entry_points={
         "console_scripts": [
             "iterm = iterm.main:cli",